@@ -0,0 +1,212 @@
+# Admission control for /chat
+#
+# A turn holds a server thread for as long as the LLM takes, so under a spike
+# unbounded acceptance just means every request times out together. The
+# AdmissionController lets at most `max_in_flight` turns run, parks a few more
+# in a short wait queue, and turns everything else away immediately with a
+# Retry-After hint. Token buckets per conversation thread and per client cap
+# how fast any one of them can send turns.
+#
+# Turns from conversations that are mid-checkout are queued ahead of the rest
+# (and have their own queue allowance), so a rush of browsers doesn't stop
+# customers who are placing orders.
+
+from collections import Counter, OrderedDict
+import itertools
+import math
+import threading
+import time
+
+
+class AdmissionRejected(Exception):
+    """A turn was not admitted; `retry_after` is a hint in seconds."""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(f"Turn rejected: {reason}")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """`rate` tokens per second, up to `burst` saved up."""
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def take(self, now: float) -> float:
+        """Take a token; returns 0 if one was available, else seconds until one will be."""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """Token buckets by key, keeping the `max_keys` most recently used."""
+
+    def __init__(self, rate: float, burst: float, max_keys: int = 10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+
+    def take(self, key: str, now: float) -> float:
+        # Callers hold the controller's lock
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.burst, now)
+            if len(self._buckets) > self.max_keys:
+                # A forgotten key starts again with a full bucket, which is what
+                # it would have refilled to by now anyway unless it's very active.
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket.take(now)
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class _Waiter:
+    def __init__(self, priority: bool, seq: int):
+        self.priority = priority
+        self.seq = seq
+        self.admitted = threading.Event()
+
+
+class Admission:
+    """An admitted turn; release() (or leaving the `with` block) frees its slot."""
+
+    def __init__(self, controller, waited: float):
+        self.controller = controller
+        self.waited = waited
+        self.started = time.monotonic()
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self.controller._release(time.monotonic() - self.started)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+        return False
+
+
+class AdmissionController:
+    """
+    Bounded in-flight turns with a short priority wait queue, plus per-thread
+    and per-client token-bucket rate limits. admit() returns an Admission or
+    raises AdmissionRejected; it only blocks while the turn is queued, for at
+    most `queue_timeout` seconds.
+    """
+
+    def __init__(self, max_in_flight: int = 32, max_queue: int = 64, queue_timeout: float = 5.0,
+                 thread_rate: float = 0.5, thread_burst: float = 5, client_rate: float = 2.0,
+                 client_burst: float = 20, max_tracked: int = 10000):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.thread_limits = RateLimiter(thread_rate, thread_burst, max_tracked)
+        self.client_limits = RateLimiter(client_rate, client_burst, max_tracked)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._waiters = []
+        self._seq = itertools.count()
+        # Smoothed turn duration, for Retry-After when the queue is full
+        self._turn_seconds = 5.0
+        self.admitted = 0
+        self.admitted_priority = 0
+        self.rejected = Counter()
+        self.wait_seconds = 0.0
+
+    def admit(self, thread_id: str, client: str, priority=False) -> Admission:
+        """
+        `priority` is a bool or a callable returning one. A callable is only
+        called if the turn has to queue, and then without the lock held, so
+        an expensive check (e.g. reading the conversation) is never paid by
+        turns that are rejected by a rate limit or admitted straight away.
+        """
+        now = time.monotonic()
+        with self._lock:
+            for reason, limiter, key in (("client_rate", self.client_limits, client), ("thread_rate", self.thread_limits, thread_id)):
+                wait = limiter.take(key, now)
+                if wait:
+                    self.rejected[reason] += 1
+                    raise AdmissionRejected(reason, wait)
+            if self._in_flight < self.max_in_flight and not self._waiters:
+                return self._admitted(False, 0.0)
+
+        if callable(priority):
+            priority = bool(priority())
+        with self._lock:
+            # A slot may have freed up while the priority was worked out
+            if self._in_flight < self.max_in_flight and not self._waiters:
+                return self._admitted(priority, time.monotonic() - now)
+            queued = sum(1 for w in self._waiters if w.priority == priority)
+            if queued >= self.max_queue:
+                self.rejected["queue_full"] += 1
+                raise AdmissionRejected("queue_full", self._retry_after())
+            waiter = _Waiter(priority, next(self._seq))
+            self._waiters.append(waiter)
+            self._waiters.sort(key=lambda w: (not w.priority, w.seq))
+
+        waiter.admitted.wait(self.queue_timeout)
+        with self._lock:
+            # Checked again under the lock: a slot may have been handed over just as the wait timed out
+            if not waiter.admitted.is_set():
+                self._waiters.remove(waiter)
+                self.rejected["queue_timeout"] += 1
+                raise AdmissionRejected("queue_timeout", self._retry_after())
+            return self._admitted(priority, time.monotonic() - now, counted=True)
+
+    def _admitted(self, priority: bool, waited: float, counted: bool = False) -> Admission:
+        # With the lock held. A queued turn's slot was already taken for it in _release().
+        if not counted:
+            self._in_flight += 1
+        self.admitted += 1
+        self.admitted_priority += priority
+        self.wait_seconds += waited
+        return Admission(self, waited)
+
+    def _release(self, turn_seconds: float):
+        with self._lock:
+            self._turn_seconds += 0.1 * (turn_seconds - self._turn_seconds)
+            if self._waiters:
+                # Hand the slot straight to the next waiter
+                self._waiters.pop(0).admitted.set()
+            else:
+                self._in_flight -= 1
+
+    def _retry_after(self) -> float:
+        # Roughly when the turns ahead of a new arrival will have drained
+        return max(1.0, self._turn_seconds * (len(self._waiters) + 1) / self.max_in_flight)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "in_flight": self._in_flight,
+                "max_in_flight": self.max_in_flight,
+                "queue_depth": len(self._waiters),
+                "queue_depth_priority": sum(1 for w in self._waiters if w.priority),
+                "max_queue": self.max_queue,
+                "admitted": self.admitted,
+                "admitted_priority": self.admitted_priority,
+                "rejected": dict(self.rejected),
+                "rejected_total": sum(self.rejected.values()),
+                "wait_seconds": self.wait_seconds,
+                "tracked_threads": len(self.thread_limits),
+                "tracked_clients": len(self.client_limits),
+            }
+
+
+def retry_after_header(seconds: float) -> str:
+    return str(max(1, math.ceil(seconds)))
@@ -0,0 +1,388 @@
+# Sales analytics export
+#
+# Reporting reads Parquet files rather than the live chatbot database. An
+# export copies the Orders, OrderItems and OrderStatus rows added since the
+# previous export (tracked by ID watermarks) out of the database through a
+# read-only connection, in one short read transaction, and appends them as
+# Parquet parts partitioned by order date. It then recomputes the daily
+# rollups for just the days those rows touch:
+#
+#   daily_sales      orders, cancellations, revenue, average order value, items sold
+#   top_items        quantity and revenue per menu item
+#   addon_attach     order lines and lines with an add-on, for items that offer add-ons
+#   order_type_mix   orders and revenue by delivery / pickup
+#
+# AnalyticsStore answers date-range queries from the rollups, and
+# create_analytics_blueprint exposes them over HTTP. Run an export from cron
+# or a scheduler, e.g. every 15 minutes:
+#
+#   python analytics.py export --db bottega_customer_chatbot.db --tenant default
+#   python analytics.py report top-items --start 2024-07-01 --end 2024-07-31
+
+import argparse
+from datetime import datetime, timezone
+import hmac
+import json
+import logging
+import os
+import sqlite3
+import sys
+
+from flask import Blueprint, jsonify, request
+import pandas as pd
+
+
+ANALYTICS_DIR = os.environ.get("ANALYTICS_DIR", "analytics")
+# Days are counted in the restaurant's local time
+ANALYTICS_TIMEZONE = os.environ.get("ANALYTICS_TIMEZONE", "America/Los_Angeles")
+CANCELLED_STATUSES = {"cancelled", "canceled"}
+
+# Snapshot name -> (source query, primary key, timestamp columns). Each query
+# takes the watermark and returns rows with a larger primary key, joined with
+# the menu so reports never have to look anything up in the live database.
+SNAPSHOTS = {
+    "orders": ("""
+        SELECT OrderID, CustomerID, OrderDate, TotalAmount, LOWER(OrderType) AS OrderType
+        FROM Orders
+        WHERE OrderID > ?
+        ORDER BY OrderID
+    """, "OrderID", ["OrderDate"]),
+    "order_items": ("""
+        SELECT oi.OrderItemID, oi.OrderID, o.OrderDate, oi.ItemID, mi.ItemName, c.CategoryName,
+               oi.Quantity, oi.Price, oi.ConfigurationID, mc.Configuration, oi.AddOnID, ma.AddOn,
+               EXISTS (SELECT 1 FROM MenuAddOns a WHERE a.ItemID = oi.ItemID) AS AddOnsOffered
+        FROM OrderItems oi
+        JOIN Orders o ON oi.OrderID = o.OrderID
+        LEFT JOIN MenuItems mi ON oi.ItemID = mi.ItemID
+        LEFT JOIN MenuCategories c ON mi.CategoryID = c.CategoryID
+        LEFT JOIN MenuConfigurations mc ON oi.ConfigurationID = mc.ConfigurationID
+        LEFT JOIN MenuAddOns ma ON oi.AddOnID = ma.AddOnID
+        WHERE oi.OrderItemID > ?
+        ORDER BY oi.OrderItemID
+    """, "OrderItemID", ["OrderDate"]),
+    "order_status": ("""
+        SELECT os.StatusID, os.OrderID, o.OrderDate, os.Status, os.UpdatedAt
+        FROM OrderStatus os
+        JOIN Orders o ON os.OrderID = o.OrderID
+        WHERE os.StatusID > ?
+        ORDER BY os.StatusID
+    """, "StatusID", ["OrderDate", "UpdatedAt"]),
+}
+
+ROLLUPS = ["daily_sales", "top_items", "addon_attach", "order_type_mix"]
+
+
+def _connect_read_only(db_path: str):
+    conn = sqlite3.connect(f"file:{os.path.abspath(db_path)}?mode=ro", uri=True, isolation_level=None)
+    conn.execute("PRAGMA query_only = ON")
+    return conn
+
+
+def _write_atomic(df: pd.DataFrame, path: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Dot-prefixed so a file left behind by an interrupted write is skipped
+    # when the partitioned dataset directory is read
+    directory, name = os.path.split(path)
+    tmp_path = os.path.join(directory, f".{name}.tmp")
+    df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+
+class AnalyticsExporter:
+    """Incremental export of one restaurant database into `directory`."""
+
+    def __init__(self, db_path: str, directory: str, tz: str = ANALYTICS_TIMEZONE):
+        self.db_path = db_path
+        self.directory = directory
+        self.tz = tz
+        self.state_path = os.path.join(directory, "state.json")
+
+    def load_state(self) -> dict:
+        if not os.path.exists(self.state_path):
+            return {"watermarks": {name: 0 for name in SNAPSHOTS}}
+        with open(self.state_path) as f:
+            return json.load(f)
+
+    def _save_state(self, state: dict):
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f, indent=2)
+        os.replace(tmp_path, self.state_path)
+
+    def _read_increments(self, watermarks: dict) -> dict:
+        conn = _connect_read_only(self.db_path)
+        try:
+            # One read transaction, so orders and their items come from the same snapshot
+            conn.execute("BEGIN")
+            frames = {
+                name: pd.read_sql_query(query, conn, params=(watermarks.get(name, 0),))
+                for name, (query, _, _) in SNAPSHOTS.items()
+            }
+            conn.execute("COMMIT")
+            return frames
+        finally:
+            conn.close()
+
+    def _local_date(self, timestamps: pd.Series) -> pd.Series:
+        # SQLite CURRENT_TIMESTAMP values are UTC
+        parsed = pd.to_datetime(timestamps, utc=True)
+        return parsed.dt.tz_convert(self.tz).dt.strftime("%Y-%m-%d")
+
+    def export(self) -> dict:
+        """Export new rows and refresh the rollups they affect. Returns a summary."""
+        os.makedirs(self.directory, exist_ok=True)
+        state = self.load_state()
+        watermarks = dict(state["watermarks"])
+        frames = self._read_increments(watermarks)
+
+        touched_days = set()
+        exported = {}
+        for name, df in frames.items():
+            _, key, timestamp_columns = SNAPSHOTS[name]
+            exported[name] = len(df)
+            if df.empty:
+                continue
+            for column in timestamp_columns:
+                df[column] = pd.to_datetime(df[column], utc=True)
+            df["order_date"] = self._local_date(df["OrderDate"])
+            first, last = int(df[key].iloc[0]), int(df[key].iloc[-1])
+            for day, part in df.groupby("order_date"):
+                # Named by ID range, so re-running an interrupted export rewrites the same part
+                path = os.path.join(self.directory, "snapshots", name, f"order_date={day}", f"part-{first:09d}-{last:09d}.parquet")
+                _write_atomic(part.drop(columns=["order_date"]), path)
+            touched_days.update(df["order_date"].unique())
+            watermarks[name] = last
+
+        if touched_days:
+            self._refresh_rollups(sorted(touched_days))
+        self._save_state({
+            "watermarks": watermarks,
+            "exported_at": datetime.now(timezone.utc).isoformat(),
+        })
+        summary = {"rows": exported, "days_refreshed": sorted(touched_days), "watermarks": watermarks}
+        logging.info(f"Analytics export to {self.directory}: {summary['rows']}, {len(touched_days)} days refreshed")
+        return summary
+
+    # Rollups
+
+    def _read_snapshot(self, name: str, days: list) -> pd.DataFrame:
+        path = os.path.join(self.directory, "snapshots", name)
+        if not os.path.isdir(path):
+            return pd.DataFrame()
+        df = pd.read_parquet(path, filters=[("order_date", "in", days)])
+        if df.empty:
+            return df
+        df["order_date"] = df["order_date"].astype(str)
+        return df.drop_duplicates(subset=SNAPSHOTS[name][1], keep="last")
+
+    def _refresh_rollups(self, days: list):
+        orders = self._read_snapshot("orders", days)
+        items = self._read_snapshot("order_items", days)
+        statuses = self._read_snapshot("order_status", days)
+
+        if orders.empty:
+            return
+        cancelled = set()
+        if not statuses.empty:
+            latest = statuses.sort_values("StatusID").groupby("OrderID").tail(1)
+            cancelled = set(latest.loc[latest["Status"].str.lower().isin(CANCELLED_STATUSES), "OrderID"])
+        orders["cancelled"] = orders["OrderID"].isin(cancelled)
+        valid_orders = orders[~orders["cancelled"]]
+        if not items.empty:
+            items = items[~items["OrderID"].isin(cancelled)].copy()
+            items["Revenue"] = items["Quantity"] * items["Price"]
+
+        daily_sales = orders.groupby("order_date").agg(
+            orders=("OrderID", "size"),
+            cancelled_orders=("cancelled", "sum"),
+        )
+        daily_sales["revenue"] = valid_orders.groupby("order_date")["TotalAmount"].sum()
+        daily_sales["items_sold"] = items.groupby("order_date")["Quantity"].sum() if not items.empty else 0
+        daily_sales = daily_sales.fillna(0).reset_index()
+        paid_orders = daily_sales["orders"] - daily_sales["cancelled_orders"]
+        daily_sales["average_order_value"] = (daily_sales["revenue"] / paid_orders.where(paid_orders > 0)).fillna(0.0)
+
+        order_type_mix = valid_orders.groupby(["order_date", "OrderType"]).agg(
+            orders=("OrderID", "size"),
+            revenue=("TotalAmount", "sum"),
+        ).reset_index().rename(columns={"OrderType": "order_type"})
+
+        if items.empty:
+            top_items = pd.DataFrame(columns=["order_date", "item_id", "item_name", "category", "quantity", "revenue"])
+            addon_attach = pd.DataFrame(columns=["order_date", "item_id", "item_name", "order_lines", "lines_with_addon"])
+        else:
+            top_items = items.groupby(["order_date", "ItemID", "ItemName", "CategoryName"], dropna=False).agg(
+                quantity=("Quantity", "sum"),
+                revenue=("Revenue", "sum"),
+            ).reset_index().rename(columns={"ItemID": "item_id", "ItemName": "item_name", "CategoryName": "category"})
+            offered = items[items["AddOnsOffered"].astype(bool)].assign(with_addon=lambda df: df["AddOnID"].notna())
+            addon_attach = offered.groupby(["order_date", "ItemID", "ItemName"], dropna=False).agg(
+                order_lines=("OrderItemID", "size"),
+                lines_with_addon=("with_addon", "sum"),
+            ).reset_index().rename(columns={"ItemID": "item_id", "ItemName": "item_name"})
+
+        for name, df in (("daily_sales", daily_sales), ("top_items", top_items),
+                         ("addon_attach", addon_attach), ("order_type_mix", order_type_mix)):
+            self._replace_days(name, days, df)
+
+    def _replace_days(self, name: str, days: list, df: pd.DataFrame):
+        path = os.path.join(self.directory, "rollups", f"{name}.parquet")
+        if os.path.exists(path):
+            existing = pd.read_parquet(path)
+            df = pd.concat([existing[~existing["order_date"].isin(days)], df], ignore_index=True)
+        _write_atomic(df.sort_values("order_date").reset_index(drop=True), path)
+
+
+class AnalyticsStore:
+    """Date-range queries over the rollups in `directory`; `start`/`end` are inclusive YYYY-MM-DD strings."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def _rollup(self, name: str, start=None, end=None) -> pd.DataFrame:
+        path = os.path.join(self.directory, "rollups", f"{name}.parquet")
+        if not os.path.exists(path):
+            return pd.DataFrame()
+        filters = []
+        if start:
+            filters.append(("order_date", ">=", start))
+        if end:
+            filters.append(("order_date", "<=", end))
+        return pd.read_parquet(path, filters=filters or None)
+
+    def exported_at(self):
+        state_path = os.path.join(self.directory, "state.json")
+        if not os.path.exists(state_path):
+            return None
+        with open(state_path) as f:
+            return json.load(f).get("exported_at")
+
+    def daily_sales(self, start=None, end=None) -> pd.DataFrame:
+        return self._rollup("daily_sales", start, end)
+
+    def top_items(self, start=None, end=None, limit: int = 10, by: str = "quantity") -> pd.DataFrame:
+        df = self._rollup("top_items", start, end)
+        if df.empty:
+            return df
+        totals = df.groupby(["item_id", "item_name", "category"], dropna=False)[["quantity", "revenue"]].sum()
+        return totals.sort_values(by, ascending=False).head(limit).reset_index()
+
+    def addon_attach_rates(self, start=None, end=None) -> pd.DataFrame:
+        """Per item, plus an "All items" row, over the range."""
+        df = self._rollup("addon_attach", start, end)
+        if df.empty:
+            return df
+        totals = df.groupby(["item_id", "item_name"], dropna=False)[["order_lines", "lines_with_addon"]].sum().reset_index()
+        overall = pd.DataFrame([{
+            "item_id": None,
+            "item_name": "All items",
+            "order_lines": totals["order_lines"].sum(),
+            "lines_with_addon": totals["lines_with_addon"].sum(),
+        }])
+        totals = pd.concat([totals.sort_values("order_lines", ascending=False), overall], ignore_index=True)
+        totals["attach_rate"] = totals["lines_with_addon"] / totals["order_lines"]
+        return totals
+
+    def order_type_mix(self, start=None, end=None) -> pd.DataFrame:
+        df = self._rollup("order_type_mix", start, end)
+        if df.empty:
+            return df
+        totals = df.groupby("order_type")[["orders", "revenue"]].sum().reset_index()
+        totals["share"] = totals["orders"] / totals["orders"].sum()
+        return totals
+
+
+def _records(df: pd.DataFrame) -> list:
+    # NaN/NA aren't valid JSON
+    return json.loads(df.to_json(orient="records"))
+
+
+def create_analytics_blueprint(store_for_request) -> Blueprint:
+    """
+    JSON endpoints over the analytics files. `store_for_request` returns the
+    AnalyticsStore for the current request (e.g. by tenant). Requests need
+    ANALYTICS_API_KEY in an X-Analytics-Key header; with no key configured,
+    every request is refused.
+    """
+    analytics = Blueprint("analytics", __name__, url_prefix="/analytics")
+
+    @analytics.before_request
+    def check_key():
+        # Fails closed: sales data isn't served until a key is configured
+        api_key = os.environ.get("ANALYTICS_API_KEY")
+        provided = request.headers.get("X-Analytics-Key") or ""
+        if not api_key or not hmac.compare_digest(provided.encode(), api_key.encode()):
+            return jsonify({"error": "Unauthorized"}), 401
+
+    def respond(name, df):
+        store = store_for_request()
+        return jsonify({
+            "report": name,
+            "start": request.args.get("start"),
+            "end": request.args.get("end"),
+            "exported_at": store.exported_at(),
+            "rows": _records(df),
+        })
+
+    @analytics.route("/daily-sales", methods=["GET"])
+    def daily_sales():
+        args = request.args
+        return respond("daily_sales", store_for_request().daily_sales(args.get("start"), args.get("end")))
+
+    @analytics.route("/top-items", methods=["GET"])
+    def top_items():
+        args = request.args
+        by = "revenue" if args.get("by") == "revenue" else "quantity"
+        df = store_for_request().top_items(args.get("start"), args.get("end"), args.get("limit", 10, type=int), by)
+        return respond("top_items", df)
+
+    @analytics.route("/addon-attach", methods=["GET"])
+    def addon_attach():
+        args = request.args
+        return respond("addon_attach", store_for_request().addon_attach_rates(args.get("start"), args.get("end")))
+
+    @analytics.route("/order-type-mix", methods=["GET"])
+    def order_type_mix():
+        args = request.args
+        return respond("order_type_mix", store_for_request().order_type_mix(args.get("start"), args.get("end")))
+
+    return analytics
+
+
+REPORTS = {
+    "daily-sales": lambda store, args: store.daily_sales(args.start, args.end),
+    "top-items": lambda store, args: store.top_items(args.start, args.end, args.limit),
+    "addon-attach": lambda store, args: store.addon_attach_rates(args.start, args.end),
+    "order-type-mix": lambda store, args: store.order_type_mix(args.start, args.end),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export and query sales analytics")
+    parser.add_argument("--dir", default=ANALYTICS_DIR, help="Analytics root directory")
+    parser.add_argument("--tenant", default=os.environ.get("DEFAULT_TENANT_ID", "default"), help="Location, a subdirectory of --dir")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export = commands.add_parser("export", help="Export new orders and refresh rollups")
+    export.add_argument("--db", default=os.environ.get("DB_NAME", "bottega_customer_chatbot.db"))
+
+    report = commands.add_parser("report", help="Print a report")
+    report.add_argument("report", choices=sorted(REPORTS))
+    report.add_argument("--start", help="First day, YYYY-MM-DD")
+    report.add_argument("--end", help="Last day, YYYY-MM-DD")
+    report.add_argument("--limit", type=int, default=10)
+    args = parser.parse_args()
+
+    directory = os.path.join(args.dir, args.tenant)
+    if args.command == "export":
+        summary = AnalyticsExporter(args.db, directory).export()
+        print(json.dumps(summary, indent=2))
+    else:
+        df = REPORTS[args.report](AnalyticsStore(directory), args)
+        if df.empty:
+            sys.exit(f"No data in {directory}; run an export first")
+        print(df.to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,14 @@
 # Standard library imports
 from datetime import datetime
 import getpass
+import hmac
 import os
 from typing import Annotated, Dict, List, Literal, Optional
 import uuid
 import logging
+import random
+import threading
+import time
 
 # Third-party imports
 from dotenv import load_dotenv
@@ -13,9 +17,10 @@ import sqlite3
 from typing_extensions import TypedDict
 
 # Langchain imports
+import anthropic
 from langchain_anthropic import ChatAnthropic
 from langchain_community.tools.tavily_search import TavilySearchResults
-from langchain_core.messages import ToolMessage
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.runnables import Runnable, RunnableConfig
 from langchain_core.runnables import RunnableLambda
@@ -28,11 +33,13 @@ from langgraph.graph.message import AnyMessage, add_messages
 from langgraph.prebuilt import ToolNode, tools_condition
 
 # Twilio import
+from twilio.http.http_client import TwilioHttpClient
 from twilio.rest import Client
 
 # Flask imports
 from flask import Flask, request, Response, stream_with_context, jsonify, session, send_from_directory, render_template, url_for, render_template, Blueprint
 from flask_cors import CORS
+from werkzeug.middleware.proxy_fix import ProxyFix
 import uuid
 import json
 
@@ -43,6 +50,19 @@ from stripe.error import StripeError
 from datetime import datetime
 import logging
 
+# Local imports
+from admission import AdmissionController, AdmissionRejected, retry_after_header
+from analytics import ANALYTICS_DIR, AnalyticsStore, create_analytics_blueprint
+from order_status import (
+    append_order_status, check_status_token, kitchen_status_subject, order_status_subject, sign_status_token,
+)
+from checkpointer import WriteBehindSaver, wrote_tool_results
+from metrics import turn_metrics
+from payments import PaymentLinkService, configure_stripe
+from static_assets import create_static_blueprint, precompress
+from tenants import Tenant, TenantCache, UnknownTenant, current_tenant, load_tenants, lookup_tenant
+from transport import ProviderUnavailable, get_transport, transport_stats
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -52,27 +72,160 @@ twilio_phone_number = "+18336102490"
 
 restaurant_phone_number = "+15305649326"
 
-client = Client(os.environ["TWILIO_ACCOUNT_SID"], os.environ["TWILIO_AUTH_TOKEN"])
+# Provider clients share pooled keep-alive sessions with explicit timeouts,
+# concurrency limits and circuit breakers (see transport.py)
+twilio_transport = get_transport("twilio")
+twilio_http_client = TwilioHttpClient()
+twilio_http_client.session = twilio_transport.session()
+client = Client(os.environ["TWILIO_ACCOUNT_SID"], os.environ["TWILIO_AUTH_TOKEN"], http_client=twilio_http_client)
+
+stripe_transport = get_transport("stripe")
+configure_stripe(
+    os.environ["STRIPE_SECRET_KEY"],
+    api_base=os.environ.get("STRIPE_API_BASE"),
+    timeout=stripe_transport.timeout,
+    session=stripe_transport.session(),
+)
+payment_links = PaymentLinkService()
 
-stripe.api_key = os.environ["STRIPE_SECRET_KEY"]
+anthropic_transport = get_transport("anthropic")
 
 # Function to send SMS
 def send_sms(to, body):
-    message = client.messages.create(
-        body=body,
-        from_=twilio_phone_number,
-        to=to
-    )
+    try:
+        message = client.messages.create(
+            body=body,
+            from_=get_tenant().twilio_phone_number,
+            to=to
+        )
+    except Exception as e:
+        logging.error(f"Error sending SMS: {str(e)}")
+        return None
     return message.sid
 
 # Database connection
-DB_NAME = 'bottega_customer_chatbot.db'
+DB_NAME = os.environ.get('DB_NAME', 'bottega_customer_chatbot.db')
+
+# SQLite lock contention, exported at /metrics. Errors on the checkpoint
+# database are also counted under checkpoint_*, and checkpoint_lock_* is
+# time spent waiting for the checkpoint connection's write lock.
+sqlite_stats = {
+    "busy": 0,
+    "errors": 0,
+    "checkpoint_busy": 0,
+    "checkpoint_errors": 0,
+    "checkpoint_lock_waits": 0,
+    "checkpoint_lock_wait_seconds": 0.0,
+}
+sqlite_stats_lock = threading.Lock()
+
+def _record_sqlite_error(e, prefix=""):
+    message = str(e)
+    busy = "locked" in message or "busy" in message
+    with sqlite_stats_lock:
+        sqlite_stats["errors"] += 1
+        if prefix:
+            sqlite_stats[f"{prefix}errors"] += 1
+        if busy:
+            sqlite_stats["busy"] += 1
+            if prefix:
+                sqlite_stats[f"{prefix}busy"] += 1
+    if busy:
+        logging.warning(f"SQLite busy: {message}")
+
+class InstrumentedCursor(sqlite3.Cursor):
+    def execute(self, *args, **kwargs):
+        try:
+            return super().execute(*args, **kwargs)
+        except sqlite3.OperationalError as e:
+            _record_sqlite_error(e, self.connection.stats_prefix)
+            raise
 
-def get_db_connection():
-    conn = sqlite3.connect(DB_NAME)
+class InstrumentedConnection(sqlite3.Connection):
+    stats_prefix = ""
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, *args, **kwargs):
+        return self.cursor().execute(*args, **kwargs)
+
+    def commit(self):
+        try:
+            return super().commit()
+        except sqlite3.OperationalError as e:
+            _record_sqlite_error(e, self.stats_prefix)
+            raise
+
+class CheckpointConnection(InstrumentedConnection):
+    stats_prefix = "checkpoint_"
+
+class TimedLock:
+    """A lock that records how often, and for how long, callers had to wait for it."""
+
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        if not self._lock.acquire(blocking=False):
+            started = time.monotonic()
+            self._lock.acquire()
+            with sqlite_stats_lock:
+                sqlite_stats[f"{self.prefix}lock_waits"] += 1
+                sqlite_stats[f"{self.prefix}lock_wait_seconds"] += time.monotonic() - started
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._lock.release()
+        return False
+
+def connect_db(db_name):
+    # Pooled connections are handed between request threads
+    conn = sqlite3.connect(db_name, factory=InstrumentedConnection, check_same_thread=False)
     conn.row_factory = sqlite3.Row
     return conn
 
+# Restaurant locations. The default one is this file's original single
+# location; others come from TENANTS_FILE (see tenants.py).
+DEFAULT_TENANT_ID = os.environ.get('DEFAULT_TENANT_ID', 'default')
+default_tenant = Tenant(
+    DEFAULT_TENANT_ID,
+    name="Bottega Restaurant",
+    db_name=DB_NAME,
+    twilio_phone_number=twilio_phone_number,
+    restaurant_phone_number=restaurant_phone_number,
+    address="2020 Mission St, San Francisco, CA 94110, United States",
+    cancellation_phone_number="+14156909607",
+)
+tenants = load_tenants(default_tenant, os.environ.get('TENANTS_FILE'))
+
+# Per-tenant connection pools, order status feeds and catalog caches
+tenant_cache = TenantCache(
+    connect_db,
+    max_tenants=int(os.environ.get('MAX_CACHED_TENANTS', 32)),
+    catalog_ttl=float(os.environ.get('CATALOG_TTL', 300)),
+)
+
+def get_tenant() -> Tenant:
+    return current_tenant.get(default_tenant)
+
+def tenant_resources():
+    return tenant_cache.get(get_tenant())
+
+def get_db_connection():
+    return tenant_resources().pool.connection()
+
+def tenant_thread_id(thread_id: str) -> str:
+    # Keeps conversations of different locations apart in the shared checkpoint DB.
+    # Client thread IDs can't contain ":" (chat() rejects them), so an unprefixed
+    # default-location ID can never name another location's thread.
+    tenant = get_tenant()
+    return thread_id if tenant is default_tenant else f"{tenant.tenant_id}:{thread_id}"
+
+# Open the default location up front, as before
+tenant_resources()
+
 # Define tools
 
 import re
@@ -183,6 +336,9 @@ def fetch_customer_orders(customer_id: int) -> List[Dict]:
 @tool
 def get_menu_categories() -> List[Dict]:
     """Fetch all menu categories."""
+    return tenant_resources().catalog("categories", _load_menu_categories)
+
+def _load_menu_categories() -> List[Dict]:
     with get_db_connection() as conn:
         cursor = conn.cursor()
         cursor.execute("SELECT * FROM MenuCategories")
@@ -192,6 +348,9 @@ def get_menu_categories() -> List[Dict]:
 @tool
 def get_menu_items(category_id: Optional[int] = None) -> List[Dict]:
     """Fetch menu items, optionally filtered by category, including configurations and add-ons."""
+    return tenant_resources().catalog(("items", category_id), lambda: _load_menu_items(category_id))
+
+def _load_menu_items(category_id: Optional[int]) -> List[Dict]:
     with get_db_connection() as conn:
         cursor = conn.cursor()
         if category_id:
@@ -275,7 +434,8 @@ def view_cart(customer_id: int) -> List[Dict]:
 def place_order(customer_id: int, order_type: str) -> str:
     """Place an order for the customer, including configurations, add-ons, and special instructions, and generate a Stripe payment link."""
     logging.info(f"Starting place_order for customer_id: {customer_id}, order_type: {order_type}")
-    
+    tenant = get_tenant()
+
     with get_db_connection() as conn:
         cursor = conn.cursor()
         try:
@@ -330,13 +490,14 @@ def place_order(customer_id: int, order_type: str) -> str:
             """, (order_id, cart_id))
 
             # Set initial order status
-            cursor.execute("INSERT INTO OrderStatus (OrderID, Status) VALUES (?, 'Pending')", (order_id,))
+            append_order_status(cursor, order_id, 'Pending')
             
             # Clear the cart
             cursor.execute("DELETE FROM CartItems WHERE CartID = ?", (cart_id,))
 
             # Commit the transaction
             conn.commit()
+            tenant_resources().feed.notify()
 
             # Fetch customer details
             cursor.execute("SELECT Name, Phone, Address FROM Customers WHERE CustomerID = ?", (customer_id,))
@@ -353,33 +514,8 @@ def place_order(customer_id: int, order_type: str) -> str:
 
             # Generate Stripe Payment Link
             try:
-                logging.info(f"Creating Stripe Price for order {order_id}")
-                price = stripe.Price.create(
-                    unit_amount=int(total_amount * 100),  # Convert to cents
-                    currency="usd",
-                    product_data={
-                        "name": f"Order #{order_id} - Bottega Restaurant",
-                    },
-                )
-                logging.info(f"Stripe Price created successfully: {price.id}")
-
                 logging.info(f"Creating Stripe Payment Link for order {order_id}")
-                payment_link = stripe.PaymentLink.create(
-                    line_items=[{
-                        "price": price.id,
-                        "quantity": 1,
-                    }],
-                    after_completion={
-                        "type": "redirect",
-                        "redirect": {"url": f"https://yourwebsite.com/order-confirmation/{order_id}"}
-                    },
-                    metadata={
-                        "order_id": str(order_id),
-                        "customer_id": str(customer_id),
-                        "order_type": order_type,
-                    },
-                )
-                payment_url = payment_link.url
+                payment_url = payment_links.create_payment_link(order_id, customer_id, order_type, total_amount, tenant)
                 logging.info(f"Stripe Payment Link created successfully: {payment_url}")
             except stripe.error.StripeError as e:
                 logging.error(f"Stripe error occurred: {str(e)}")
@@ -400,7 +536,7 @@ def place_order(customer_id: int, order_type: str) -> str:
             customer_message = f"""
 Dear {customer['Name']},
 
-Thank you for your order with Bottega Restaurant!
+Thank you for your order with {tenant.name}!
 
 Order Details:
 Order ID: {order_id}
@@ -426,10 +562,14 @@ Your order will be prepared once payment is received.
             else:
                 customer_message += "This is a pickup order. Please collect your order from our restaurant.\n"
 
-            customer_message += """
-For any questions, please contact us @ +15305649326.
+            status_url = order_status_url(tenant, order_id)
+            if status_url:
+                customer_message += f"Track your order: {status_url}\n"
+
+            customer_message += f"""
+For any questions, please contact us @ {tenant.restaurant_phone_number}.
 
-Thank you for choosing Bottega Restaurant!
+Thank you for choosing {tenant.name}!
 """
             sms_result = send_sms(customer['Phone'], customer_message)
             if not sms_result:
@@ -461,7 +601,7 @@ Total Amount: ${total_amount:.2f}
 
             restaurant_message += f"Please prepare this order for {order_type} once payment is confirmed."
 
-            sms_result = send_sms(restaurant_phone_number, restaurant_message)
+            sms_result = send_sms(tenant.restaurant_phone_number, restaurant_message)
             if not sms_result:
                 logging.warning("Failed to send SMS to restaurant")
 
@@ -546,12 +686,9 @@ def get_order_status(order_id: int) -> str:
     with get_db_connection() as conn:
         cursor = conn.cursor()
         cursor.execute("""
-            SELECT os.Status, o.OrderDate, o.TotalAmount, o.OrderType
-            FROM OrderStatus os
-            JOIN Orders o ON os.OrderID = o.OrderID
-            WHERE os.OrderID = ?
-            ORDER BY os.UpdatedAt DESC
-            LIMIT 1
+            SELECT o.CurrentStatus AS Status, o.OrderDate, o.TotalAmount, o.OrderType
+            FROM Orders o
+            WHERE o.OrderID = ? AND o.CurrentStatus IS NOT NULL
         """, (order_id,))
         order_info = cursor.fetchone()
 
@@ -586,6 +723,9 @@ Items:
 @tool
 def get_item_options(item_id: int) -> Dict:
     """Fetch available configurations and add-ons for a specific menu item."""
+    return tenant_resources().catalog(("options", item_id), lambda: _load_item_options(item_id))
+
+def _load_item_options(item_id: int) -> Dict:
     with get_db_connection() as conn:
         cursor = conn.cursor()
         cursor.execute("SELECT ItemName FROM MenuItems WHERE ItemID = ?", (item_id,))
@@ -633,38 +773,262 @@ class State(TypedDict):
     messages: Annotated[list[AnyMessage], add_messages]
 
 
+# Retry policy for the assistant step
+class RetryPolicy:
+    """
+    Bounded retries for empty LLM responses and transient provider errors: at
+    most `max_attempts` calls per model, exponential backoff with full jitter
+    between them, and a latency budget (seconds) for the whole turn. Each call's
+    request timeout is what is left of the budget, less `fallback_reserve`
+    seconds held back for the fallback model while there is one to try.
+    """
+
+    def __init__(self, max_attempts: int = 3, base_delay: float = 0.5, max_delay: float = 4.0,
+                 turn_budget: float = 45.0, fallback_reserve: float = 10.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.turn_budget = turn_budget
+        self.fallback_reserve = fallback_reserve
+
+    def backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+
+def is_retryable_llm_error(e: Exception) -> bool:
+    """Timeouts, dropped connections, rate limiting and overloaded/5xx responses."""
+    if isinstance(e, anthropic.APIConnectionError):  # Includes APITimeoutError
+        return True
+    return isinstance(e, anthropic.APIStatusError) and (e.status_code in (408, 429) or e.status_code >= 500)
+
+
+def llm_breaker_verdict(e: Exception) -> Optional[bool]:
+    # For anthropic_transport.guard(): only provider errors count against the
+    # breaker. A 400/401 is the provider answering, and a local error (e.g. in
+    # prompt formatting) says nothing about it either way.
+    if is_retryable_llm_error(e):
+        return True
+    if isinstance(e, anthropic.APIStatusError):
+        return False
+    return None
+
+
+def with_request_timeout(runnable: Runnable, timeout: float) -> Runnable:
+    # The assistant runnables are `prompt | model.bind_tools(...)`; a `timeout`
+    # bound on the model is passed through to messages.create().
+    return runnable.first | runnable.last.bind(timeout=timeout)
+
+
+def runnable_model_name(runnable: Runnable) -> Optional[str]:
+    # `prompt | model.bind_tools(...)` -> the model's name, if it has one
+    return getattr(getattr(getattr(runnable, "last", None), "bound", None), "model", None)
+
+
+def is_empty_response(result) -> bool:
+    return not result.tool_calls and (
+        not result.content
+        or isinstance(result.content, list)
+        and not result.content[0].get("text")
+    )
+
+
+# Model tiers: formatting and acknowledgment steps go to a smaller, faster
+# model; planning and order placement stay on the large one.
+MODEL_TIERING = os.environ.get("MODEL_TIERING", "on").lower() not in ("0", "off", "false")
+FAST_MODEL = os.environ.get("FAST_MODEL", "claude-3-haiku-20240307")
+SMART_MODEL = os.environ.get("SMART_MODEL", "claude-3-5-sonnet-20240620")
+
+# Tools whose results the assistant only has to present or acknowledge. Results
+# during checkout always go to the large model, whichever tools they came from.
+FAST_TIER_TOOLS = {name.strip() for name in os.environ.get(
+    "FAST_TIER_TOOLS",
+    "get_menu_categories,get_menu_items,get_item_options,get_order_status,fetch_customer_orders",
+).split(",") if name.strip()}
+
+# Tools that move a conversation into (or through) checkout
+CHECKOUT_TOOLS = {"add_to_cart", "update_cart_item", "view_cart"}
+
+# Short user messages that only acknowledge the previous answer, e.g. "ok thanks" or "thanks, bye!"
+ACKNOWLEDGMENT_MAX_CHARS = 40
+_ACKNOWLEDGMENT = r"(ok(ay)?|k|cool|great|perfect|awesome|nice|thanks?( you)?( so much| a lot)?|thank you|thx|ty|got it|sounds good|bye|goodbye)"
+ACKNOWLEDGMENT_PATTERN = re.compile(
+    rf"^\W*{_ACKNOWLEDGMENT}(\W+{_ACKNOWLEDGMENT})*\W*$",
+    re.IGNORECASE,
+)
+
+
+def in_checkout(messages) -> bool:
+    """True if the cart was touched since the last order was placed."""
+    for message in reversed(messages):
+        if isinstance(message, ToolMessage):
+            if message.name == "place_order":
+                return False
+            if message.name in CHECKOUT_TOOLS:
+                return True
+    return False
+
+
+def select_model_tier(state: State) -> str:
+    """
+    Classify an assistant step as "fast" or "smart" from cheap signals: whether
+    it answers tool results and which tools they came from, whether the
+    conversation is in checkout, and the length of the user's message.
+    """
+    messages = state["messages"]
+    if not messages:
+        return "smart"
+    last = messages[-1]
+
+    if isinstance(last, ToolMessage):
+        # The step after a checkout tool result is the one that may place the order
+        if in_checkout(messages):
+            return "smart"
+        results = []
+        for message in reversed(messages):
+            if not isinstance(message, ToolMessage):
+                break
+            results.append(message)
+        if all(
+            message.name in FAST_TIER_TOOLS and not str(message.content).startswith("Error")
+            for message in results
+        ):
+            return "fast"
+        return "smart"
+
+    if isinstance(last, HumanMessage):
+        text = last.content if isinstance(last.content, str) else ""
+        if (
+            len(text) <= ACKNOWLEDGMENT_MAX_CHARS
+            and ACKNOWLEDGMENT_PATTERN.match(text)
+            and not in_checkout(messages)
+        ):
+            return "fast"
+    return "smart"
+
+
+def config_thread_id(config: RunnableConfig) -> Optional[str]:
+    # Node configs carry the caller's thread_id in metadata; some langgraph
+    # versions rewrite the configurable one with a node suffix.
+    return config.get("metadata", {}).get("thread_id") or config.get("configurable", {}).get("thread_id")
+
+
 # Define the assistant class
 class Assistant:
-    def __init__(self, runnable: Runnable):
+    def __init__(self, runnable: Runnable, fallback_runnable: Optional[Runnable] = None,
+                 retry_policy: Optional[RetryPolicy] = None, fast_runnable: Optional[Runnable] = None):
         self.runnable = runnable
+        self.fallback_runnable = fallback_runnable
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.fast_runnable = fast_runnable
 
     def __call__(self, state: State, config: RunnableConfig):
+        thread_id = config_thread_id(config)
+        policy = self.retry_policy
+        deadline = turn_metrics.started(thread_id) + policy.turn_budget
+        tier = select_model_tier(state) if self.fast_runnable is not None else "smart"
+        # Each model is tried in turn: a fast step that keeps failing escalates
+        # to the large model, and from there to the fallback model.
+        models = [("fast", self.fast_runnable)] if tier == "fast" else []
+        models += [("smart", self.runnable), ("fallback", self.fallback_runnable)]
+        models = [(name, runnable) for name, runnable in models if runnable is not None]
+        # The fallback model defaults to the fast one; a fast step that failed on it skips it
+        tried, distinct = set(), []
+        for name, runnable in models:
+            model = runnable_model_name(runnable)
+            if model is None or model not in tried:
+                distinct.append((name, runnable))
+                tried.add(model)
+        models = distinct
+        (tier, runnable), models = models[0], models[1:]
+        attempt, prompt_state = 0, state
         while True:
-            result = self.runnable.invoke(state)
-            # If the LLM happens to return an empty response, we will re-prompt it
-            # for an actual response.
-            if not result.tool_calls and (
-                not result.content
-                or isinstance(result.content, list)
-                and not result.content[0].get("text")
-            ):
-                messages = state["messages"] + [("user", "Respond with a real output.")]
-                state = {**state, "messages": messages}
-                messages = state["messages"] + [("user", "Respond with a real output.")]
-                state = {**state, "messages": messages}
+            attempt += 1
+            has_fallback = bool(models)
+            timeout = deadline - time.monotonic() - (policy.fallback_reserve if has_fallback else 0)
+            result, error = None, None
+            if timeout > 0:
+                started = time.monotonic()
+                try:
+                    with anthropic_transport.guard(is_failure=llm_breaker_verdict):
+                        result = with_request_timeout(runnable, timeout).invoke({**prompt_state, **get_tenant().prompt_vars()})
+                except Exception as e:
+                    if not is_retryable_llm_error(e):
+                        raise
+                    error = e
+                elapsed = time.monotonic() - started
+                usage = getattr(result, "usage_metadata", None) or {}
+                turn_metrics.add(thread_id, **{
+                    "llm_calls": 1,
+                    "llm_errors": int(error is not None),
+                    "llm_seconds": elapsed,
+                    f"{tier}_calls": 1,
+                    f"{tier}_seconds": elapsed,
+                    f"{tier}_input_tokens": usage.get("input_tokens", 0),
+                    f"{tier}_output_tokens": usage.get("output_tokens", 0),
+                })
+                if result is not None and not is_empty_response(result):
+                    break
+            problem = f"{type(error).__name__}: {error}" if error else "empty response" if result is not None else "no time left"
+
+            # Retry the same model within its attempts and its share of the
+            # budget, then move on to the next model, then give up.
+            remaining = deadline - time.monotonic() - (policy.fallback_reserve if has_fallback else 0)
+            if attempt >= policy.max_attempts or remaining <= 0:
+                if not has_fallback or deadline - time.monotonic() <= 0:
+                    logging.error(f"Assistant gave up after {attempt} attempts, last: {problem} (thread {thread_id})")
+                    result = AIMessage(content="Sorry, I'm having trouble answering right now. Could you please say that again? 🙏")
+                    break
+                logging.warning(f"Switching from {tier} to {models[0][0]} model after {attempt} attempts, last: {problem} (thread {thread_id})")
+                turn_metrics.add(thread_id, fallbacks=1)
+                (tier, runnable), models = models[0], models[1:]
+                attempt = 0
             else:
-                break
+                delay = min(policy.backoff(attempt), remaining)
+                logging.warning(f"Retrying assistant step after {problem} (thread {thread_id})")
+                turn_metrics.add(thread_id, retries=1, backoff_seconds=delay)
+                time.sleep(delay)
+            if result is not None:
+                # The LLM returned an empty response. Re-prompt it for an actual
+                # response; the nudge is only sent, never added to the state.
+                prompt_state = {**state, "messages": state["messages"] + [("user", "Respond with a real output.")]}
         return {"messages": result}
 
 
 # Initialize the LLMs
-llm = ChatAnthropic(model="claude-3-5-sonnet-20240620", temperature=1)
+llm = ChatAnthropic(
+    model=SMART_MODEL,
+    temperature=1,
+    default_request_timeout=anthropic_transport.read_timeout,
+    max_retries=0,  # Assistant retries within the turn budget
+)
+
+# Used for formatting and acknowledgment steps
+fast_llm = ChatAnthropic(
+    model=FAST_MODEL,
+    temperature=1,
+    default_request_timeout=anthropic_transport.read_timeout,
+    max_retries=0,  # Assistant retries within the turn budget
+)
+
+# Used when the primary model keeps returning empty responses
+fallback_llm = ChatAnthropic(
+    model=os.environ.get("ASSISTANT_FALLBACK_MODEL", "claude-3-haiku-20240307"),
+    temperature=1,
+    default_request_timeout=anthropic_transport.read_timeout,
+    max_retries=0,  # Assistant retries within the turn budget
+)
+
+assistant_retry_policy = RetryPolicy(
+    max_attempts=int(os.environ.get("ASSISTANT_MAX_ATTEMPTS", 3)),
+    turn_budget=float(os.environ.get("ASSISTANT_TURN_BUDGET", 45)),
+    fallback_reserve=float(os.environ.get("ASSISTANT_FALLBACK_RESERVE", 10)),
+)
 
 assistant_prompt = ChatPromptTemplate.from_messages(
     [
         (
             "system",
-            "You are Bottega-Bot, Bottega restaurant's customer support AI designed to assist users with the following specific tasks:\n\n"
+            "You are Bottega-Bot, {restaurant_name}'s customer support AI designed to assist users with the following specific tasks:\n\n"
             "1. **Customer info:** Manage customer information using the `create_or_update_customer` tool.\n"
             "2. **Check customer exists:** Verify if a customer is in the system using the `check_customer_exists` tool.\n"
             "3. **Fetch previous orders:** Retrieve customer's order history with the `fetch_customer_orders` tool.\n"
@@ -711,14 +1075,14 @@ assistant_prompt = ChatPromptTemplate.from_messages(
             "10. **Update Cart**: If needed, use `update_cart_item` to modify quantities, options, or remove items. ✏️🛒\n"
             "11. **Place Order**: Ask if the order is for delivery or pickup. 🚚 or 🏃\n"
             "    - For delivery, check if there's an address on file. If not, ask for it and use `update_customer_address`. 🏠\n"
-            "    - For pickup, remind the customer of the restaurant address (2020 Mission St, San Francisco, CA 94110, United States). 🗺️\n"
+            "    - For pickup, remind the customer of the restaurant address ({restaurant_address}). 🗺️\n"
             "    - Confirm order details and use `place_order` to create the order. ✅\n"
             "12. **Order Confirmation**: After placing the order, inform the customer: 📱💳\n"
             "    - A confirmation text with a payment link has been sent to their phone.\n"
             "    - The order will be prepared once payment is received.\n"
             "    - They can track their order status using the same text message.\n"
             "13. **Check Order Status**: Use `get_order_status` to provide updates if requested. 🕒\n\n"
-            "For order cancellations, provide the restaurant's contact number: +14156909607. ❌📞\n\n"
+            "For order cancellations, provide the restaurant's contact number: {cancellation_phone}. ❌📞\n\n"
             "Always confirm order details before placing and clearly communicate next steps after ordering. 👍✨\n"
             "\nCurrent time: {time}.",
         ),
@@ -751,6 +1115,13 @@ sensitive_tool_names = {t.name for t in sensitive_tools}
 assistant_runnable = assistant_prompt | llm.bind_tools(
     safe_tools + sensitive_tools
 )
+fallback_assistant_runnable = assistant_prompt | fallback_llm.bind_tools(
+    safe_tools + sensitive_tools
+)
+# Order placement stays with the large model: the fast tier can't call place_order
+fast_assistant_runnable = assistant_prompt | fast_llm.bind_tools(
+    [t for t in safe_tools + sensitive_tools if t.name != "place_order"]
+)
 
 # Build the state graph
 builder = StateGraph(State)
@@ -769,7 +1140,12 @@ def route_tools(state: State) -> Literal["safe_tools", "sensitive_tools", "__end
     return "sensitive_tools" if has_sensitive_tool else "safe_tools"
 
 # Define nodes and edges
-builder.add_node("assistant", Assistant(assistant_runnable))
+builder.add_node("assistant", Assistant(
+    assistant_runnable,
+    fallback_assistant_runnable,
+    assistant_retry_policy,
+    fast_runnable=fast_assistant_runnable if MODEL_TIERING else None,
+))
 builder.add_node("safe_tools", create_tool_node_with_fallback(safe_tools))
 builder.add_node("sensitive_tools", create_tool_node_with_fallback(sensitive_tools))
 builder.set_entry_point("assistant")
@@ -780,28 +1156,116 @@ builder.add_conditional_edges(
 builder.add_edge("safe_tools", "assistant")
 builder.add_edge("sensitive_tools", "assistant")
 
-# Use a file-based connection string for persistence
-memory = SqliteSaver.from_conn_string("customer_chatbot_new_memory.db")
+# Use a file-based connection string for persistence. Graph steps are kept
+# in memory and written once per turn (see checkpointer.py).
+checkpoint_saver = SqliteSaver(sqlite3.connect(
+    os.environ.get("CHECKPOINT_DB", "customer_chatbot_new_memory.db"),
+    factory=CheckpointConnection,
+    check_same_thread=False,
+))
+checkpoint_saver.lock = TimedLock("checkpoint_")
+# Tools that aren't safe to run twice: their steps are written as soon as they
+# happen, so a crash before the end of the turn can't lose the record of them.
+NON_IDEMPOTENT_TOOLS = {"place_order", "add_to_cart"}
+memory = WriteBehindSaver(
+    checkpoint_saver,
+    max_threads=int(os.environ.get("CHECKPOINT_CACHE_THREADS", 1000)),
+    flush_interval=float(os.environ.get("CHECKPOINT_FLUSH_INTERVAL", 5)),
+    flush_after=wrote_tool_results(NON_IDEMPOTENT_TOOLS),
+).start()
 graph = builder.compile(
     checkpointer=memory,
     interrupt_before=["sensitive_tools"],
 )
 
 # app = Flask(__name__)
-app = Flask(__name__, static_folder='./build', static_url_path='/')
+# The React build is served by the static_assets blueprint rather than Flask's
+# built-in static route, so it gets precompression and long-lived caching.
+app = Flask(__name__, static_folder=None)
+app.config['USE_X_SENDFILE'] = os.environ.get('STATIC_X_SENDFILE', '').lower() in ('1', 'true', 'on')
+
+BUILD_DIR = os.environ.get('BUILD_DIR', './build')
+if os.path.isdir(BUILD_DIR) and os.environ.get('STATIC_PRECOMPRESS', 'on').lower() not in ('0', 'off', 'false'):
+    precompress(BUILD_DIR)
+app.register_blueprint(create_static_blueprint(BUILD_DIR))
 
-# define a route for the default URL
-@app.route('/')
-def serve_react():
-    return send_from_directory(app.static_folder, 'index.html')
+# Sales reports, served from the files written by `python analytics.py export`
+app.register_blueprint(create_analytics_blueprint(
+    lambda: AnalyticsStore(os.path.join(ANALYTICS_DIR, get_tenant().tenant_id))
+))
 
 CORS(app)
+
+# Behind a load balancer, set to the number of proxies so that client
+# addresses (used for per-client rate limits) come from X-Forwarded-For.
+# On Cloud Run (K_SERVICE is set) every request comes through Google's front
+# end, which appends the client address, so one proxy is trusted by default;
+# otherwise every customer would share a single client rate limit.
+TRUSTED_PROXIES = int(os.environ.get('TRUSTED_PROXIES', 1 if os.environ.get('K_SERVICE') else 0))
+if TRUSTED_PROXIES:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES, x_proto=TRUSTED_PROXIES)
+
+# Admission control for /chat: bounded in-flight turns, a short wait queue
+# and per-thread / per-client rate limits (see admission.py)
+admission = AdmissionController(
+    max_in_flight=int(os.environ.get('ADMISSION_MAX_IN_FLIGHT', anthropic_transport.max_concurrency)),
+    max_queue=int(os.environ.get('ADMISSION_MAX_QUEUE', 64)),
+    queue_timeout=float(os.environ.get('ADMISSION_QUEUE_TIMEOUT', 5)),
+    thread_rate=float(os.environ.get('ADMISSION_THREAD_RATE', 0.5)),
+    thread_burst=float(os.environ.get('ADMISSION_THREAD_BURST', 5)),
+    client_rate=float(os.environ.get('ADMISSION_CLIENT_RATE', 2)),
+    client_burst=float(os.environ.get('ADMISSION_CLIENT_BURST', 20)),
+)
+
+def is_checkout_turn(checkpoint_thread_id: str) -> bool:
+    """Whether the conversation has an active cart or an order about to be placed."""
+    saved = memory.get_tuple({"configurable": {"thread_id": checkpoint_thread_id}})
+    if saved is None:
+        return False
+    messages = saved.checkpoint["channel_values"].get("messages", [])
+    if messages and isinstance(messages[-1], AIMessage) and any(
+        call["name"] == "place_order" for call in messages[-1].tool_calls
+    ):
+        return True
+    return in_checkout(messages)
+
+# Order status feed timings (seconds)
+STATUS_HEARTBEAT_SECONDS = 15
+STATUS_LONG_POLL_SECONDS = 25
+# Signs the per-order status tokens sent to customers and the kitchen's stream tokens
+ORDER_STATUS_SECRET = os.environ.get('ORDER_STATUS_SECRET', '')
+KITCHEN_STREAM_TOKEN_SECONDS = int(os.environ.get('KITCHEN_STREAM_TOKEN_SECONDS', 300))
+ORDER_STATUS_URL = os.environ.get('ORDER_STATUS_URL', '')
+
+def order_status_url(tenant: Tenant, order_id: int) -> Optional[str]:
+    """The customer's link to follow their order, e.g. https://.../orders/{order_id}?token={token}."""
+    if not ORDER_STATUS_URL or not ORDER_STATUS_SECRET:
+        return None
+    token = sign_status_token(ORDER_STATUS_SECRET, order_status_subject(tenant.tenant_id, order_id))
+    return ORDER_STATUS_URL.format(order_id=order_id, token=token, tenant_id=tenant.tenant_id)
+
 app.secret_key = 'testing'  # Set a secret key for sessions
 
 # Set up logging
 logging.basicConfig(filename='chat.log', level=logging.INFO, 
                     format='%(asctime)s - %(message)s', datefmt='%d-%b-%y %H:%M:%S')
 
+# Resolve the restaurant location of each request
+@app.before_request
+def resolve_tenant():
+    tenant_id = (
+        request.headers.get('X-Tenant-ID')
+        or (request.get_json(silent=True) or {}).get('tenant_id')
+        or request.args.get('tenant_id')
+        or DEFAULT_TENANT_ID
+    )
+    try:
+        tenant = lookup_tenant(tenants, tenant_id)
+    except UnknownTenant:
+        logging.warning(f"Request for unknown tenant {tenant_id!r}")
+        return jsonify({"error": f"Unknown location: {tenant_id}"}), 404
+    current_tenant.set(tenant)
+
 # Define a function to print the event
 def _print_event(event, _printed: set, max_length=100000):
     response = ""
@@ -838,13 +1302,31 @@ def chat():
     if not thread_id:
         thread_id = str(uuid.uuid4())
         session['thread_id'] = thread_id
+    thread_id = str(thread_id)
+    if ':' in thread_id:
+        return jsonify({"error": "Invalid thread_id"}), 400
+
+    checkpoint_thread_id = tenant_thread_id(thread_id)
+    try:
+        admitted = admission.admit(
+            checkpoint_thread_id,
+            request.remote_addr or "unknown",
+            priority=lambda: is_checkout_turn(checkpoint_thread_id),
+        )
+    except AdmissionRejected as e:
+        logging.warning(f"Turn rejected for thread {checkpoint_thread_id}: {e.reason}")
+        response = jsonify({"error": "We're a little busy right now. Please try again in a moment.", "thread_id": thread_id})
+        response.headers['Retry-After'] = retry_after_header(e.retry_after)
+        return response, 429
 
     config = {
         "configurable": {
-            "thread_id": thread_id,
+            "thread_id": checkpoint_thread_id,
         }
     }
 
+    turn_metrics.start(checkpoint_thread_id)
+    turn_metrics.add(checkpoint_thread_id, admission_wait_seconds=admitted.waited)
     _printed = set()
     events = graph.stream(
         {"messages": ("user", user_input)}, config, stream_mode="values"
@@ -894,9 +1376,23 @@ def chat():
                     if "Ai Message" in event_text:
                         ai_response = event_text.split("Ai Message")[-1].strip()
 
+    except ProviderUnavailable as e:
+        logging.error(f"Error in chat route: {str(e)}")
+        response = jsonify({"error": "Our assistant is temporarily unavailable. Please try again shortly.", "thread_id": thread_id})
+        response.headers['Retry-After'] = str(int(e.retry_after) or 1)
+        return response, 503
     except Exception as e:
         logging.error(f"Error in chat route: {str(e)}")
         return jsonify({"error": "An error occurred processing your request"}), 500
+    finally:
+        # Make the turn durable before answering; on failure it stays pending for the next flush.
+        try:
+            memory.flush(checkpoint_thread_id)
+        except sqlite3.Error as e:
+            logging.error(f"Checkpoint flush failed for thread {checkpoint_thread_id}: {str(e)}")
+        turn_metrics.add(checkpoint_thread_id, **memory.turn_stats(checkpoint_thread_id))
+        turn_metrics.finish(checkpoint_thread_id)
+        admitted.release()
 
     # If no AI response was extracted, use the full response
     if not ai_response:
@@ -910,6 +1406,112 @@ def chat():
     response.headers['Content-Type'] = 'application/json; charset=utf-8'
     return response
 
+# Export transport and feed state for monitoring
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return jsonify({
+        "transport": transport_stats(),
+        "turns": turn_metrics.snapshot(),
+        "sqlite": sqlite_stats,
+        "checkpoints": memory.stats(),
+        "admission": admission.stats(),
+        "order_status_feed": tenant_resources().feed.stats(),
+        "tenants": tenant_cache.stats(),
+    })
+
+def kitchen_authorized() -> bool:
+    # Fails closed: without KITCHEN_API_KEY configured, nobody gets in
+    kitchen_api_key = os.environ.get('KITCHEN_API_KEY')
+    provided = request.headers.get('X-Kitchen-Key') or ''
+    return bool(kitchen_api_key) and hmac.compare_digest(provided.encode(), kitchen_api_key.encode())
+
+def status_feed_authorized(order_id) -> bool:
+    # Order IDs are sequential, so a single order needs the token it was sent
+    # with; the all-orders feed needs the kitchen key or a kitchen stream token.
+    token = request.args.get('token', '')
+    tenant_id = get_tenant().tenant_id
+    if order_id is not None:
+        return check_status_token(ORDER_STATUS_SECRET, order_status_subject(tenant_id, order_id), token)
+    return kitchen_authorized() or check_status_token(ORDER_STATUS_SECRET, kitchen_status_subject(tenant_id), token)
+
+def _status_feed_args():
+    order_id = request.args.get('order_id', type=int)
+    since = request.args.get('since', type=int)
+    if since is None:
+        since = request.headers.get('Last-Event-ID', type=int)
+    if since is None:
+        # A single order's subscriber wants its history; the kitchen feed starts from now.
+        since = 0 if order_id is not None else tenant_resources().feed.last_event_id
+    return order_id, since
+
+# Short-lived token for the kitchen's all-orders stream: EventSource can't send
+# the key in a header, and a key in the URL would end up in access logs.
+@app.route('/orders/status/stream-token', methods=['POST'])
+def kitchen_stream_token():
+    if not kitchen_authorized() or not ORDER_STATUS_SECRET:
+        return jsonify({"error": "Unauthorized"}), 401
+    expires = int(time.time()) + KITCHEN_STREAM_TOKEN_SECONDS
+    token = sign_status_token(ORDER_STATUS_SECRET, kitchen_status_subject(get_tenant().tenant_id), expires)
+    return jsonify({"token": token, "expires_at": expires})
+
+# Server-sent events stream of order status changes
+@app.route('/orders/status/stream', methods=['GET'])
+def stream_order_status():
+    order_id, since = _status_feed_args()
+    if not status_feed_authorized(order_id):
+        return jsonify({"error": "Unauthorized"}), 401
+    tenant = get_tenant()
+
+    def generate(since):
+        yield "retry: 3000\n\n"
+        while True:
+            # Looked up each time: an evicted tenant's feed is stopped and replaced
+            feed = tenant_cache.get(tenant).feed
+            events = feed.wait_for_events(since, order_id, timeout=STATUS_HEARTBEAT_SECONDS)
+            if not events:
+                yield ": keep-alive\n\n"
+                continue
+            for event in events:
+                yield f"id: {event['id']}\nevent: status\ndata: {json.dumps(event)}\n\n"
+            since = events[-1]['id']
+
+    response = Response(stream_with_context(generate(since)), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+# Long-poll fallback for clients that can't use server-sent events
+@app.route('/orders/status/poll', methods=['GET'])
+def poll_order_status():
+    order_id, since = _status_feed_args()
+    if not status_feed_authorized(order_id):
+        return jsonify({"error": "Unauthorized"}), 401
+    timeout = min(request.args.get('timeout', STATUS_LONG_POLL_SECONDS, type=float), STATUS_LONG_POLL_SECONDS)
+    feed = tenant_resources().feed
+    events = feed.wait_for_events(since, order_id, timeout=timeout)
+    last_event_id = events[-1]['id'] if events else max(since, feed.last_event_id)
+    return jsonify({"events": events, "last_event_id": last_event_id})
+
+# Append a status change, e.g. from the kitchen screen
+@app.route('/orders/<int:order_id>/status', methods=['POST'])
+def update_order_status(order_id):
+    if not kitchen_authorized():
+        return jsonify({"error": "Unauthorized"}), 401
+
+    status = (request.json or {}).get('status')
+    if not status:
+        return jsonify({"error": "No status provided"}), 400
+
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT 1 FROM Orders WHERE OrderID = ?", (order_id,))
+        if not cursor.fetchone():
+            return jsonify({"error": "Order not found"}), 404
+        status_id = append_order_status(cursor, order_id, status)
+        conn.commit()
+    tenant_resources().feed.notify()
+    return jsonify({"order_id": order_id, "status": status, "event_id": status_id})
+
 if __name__ == '__main__':
     port = int(os.environ.get('FLASK_PORT', 10000))  # Change this to 5000
-    app.run(host='0.0.0.0', port=port)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=port, threaded=True)
\ No newline at end of file
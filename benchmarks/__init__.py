@@ -0,0 +1 @@
+# Benchmarks for hot paths, run with `python -m benchmarks.<name>`
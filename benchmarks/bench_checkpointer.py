@@ -0,0 +1,114 @@
+# Checkpoint I/O benchmark: SqliteSaver vs WriteBehindSaver
+#
+# Runs scripted conversations through a small graph shaped like the
+# assistant's (assistant -> tools -> assistant ... per turn) with no LLM in
+# the loop, so the time measured is graph overhead and checkpoint I/O. Each
+# turn ends like chat() does: get_state(), then (write-behind only) a flush.
+#
+#   python -m benchmarks.bench_checkpointer --turns 30 --steps 3 --payload-kb 8
+
+import argparse
+import os
+import sqlite3
+import statistics
+import tempfile
+import time
+from typing import Annotated
+
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langgraph.checkpoint.sqlite import SqliteSaver
+from langgraph.graph import END, StateGraph
+from langgraph.graph.message import AnyMessage, add_messages
+from typing_extensions import TypedDict
+
+from checkpointer import WriteBehindSaver
+
+
+class State(TypedDict):
+    messages: Annotated[list[AnyMessage], add_messages]
+
+
+def build_graph(checkpointer, steps: int, payload: str):
+    def assistant(state: State):
+        since_user = 0
+        for message in reversed(state["messages"]):
+            if isinstance(message, HumanMessage):
+                break
+            since_user += isinstance(message, ToolMessage)
+        if since_user < steps:
+            call_id = f"call_{len(state['messages'])}"
+            return {"messages": AIMessage(content="", tool_calls=[{"name": "get_menu_items", "args": {}, "id": call_id}])}
+        return {"messages": AIMessage(content="Here you go!")}
+
+    def tools(state: State):
+        call = state["messages"][-1].tool_calls[0]
+        return {"messages": ToolMessage(content=payload, tool_call_id=call["id"], name=call["name"])}
+
+    def route(state: State):
+        return "tools" if state["messages"][-1].tool_calls else END
+
+    builder = StateGraph(State)
+    builder.add_node("assistant", assistant)
+    builder.add_node("tools", tools)
+    builder.set_entry_point("assistant")
+    builder.add_conditional_edges("assistant", route)
+    builder.add_edge("tools", "assistant")
+    return builder.compile(checkpointer=checkpointer)
+
+
+def stored_checkpoints(db_path: str) -> tuple:
+    conn = sqlite3.connect(db_path)
+    try:
+        checkpoints = conn.execute("SELECT COALESCE(SUM(LENGTH(checkpoint) + LENGTH(metadata)), 0) FROM checkpoints").fetchone()[0]
+        writes = conn.execute("SELECT COALESCE(SUM(LENGTH(value)), 0) FROM writes").fetchone()[0]
+        rows = conn.execute("SELECT COUNT(*) FROM checkpoints").fetchone()[0]
+        return checkpoints + writes, rows
+    finally:
+        conn.close()
+
+
+def run(name: str, write_behind: bool, args, workdir: str):
+    db_path = os.path.join(workdir, f"{name}.db")
+    saver = SqliteSaver.from_conn_string(db_path)
+    if write_behind:
+        saver = WriteBehindSaver(saver, flush_interval=0)
+    graph = build_graph(saver, args.steps, "x" * (args.payload_kb * 1024))
+
+    timings, last_turns = [], []
+    for conversation in range(args.conversations):
+        config = {"configurable": {"thread_id": f"{name}-{conversation}"}}
+        for turn in range(args.turns):
+            started = time.perf_counter()
+            graph.invoke({"messages": [("user", f"turn {turn}")]}, config)
+            graph.get_state(config)
+            if write_behind:
+                saver.flush(config["configurable"]["thread_id"])
+            timings.append(time.perf_counter() - started)
+        last_turns.append(timings[-1])
+
+    total_bytes, rows = stored_checkpoints(db_path)
+    turns = len(timings)
+    timings.sort()
+    print(
+        f"{name:<14} p50={statistics.median(timings) * 1000:7.2f}ms "
+        f"p95={timings[int(turns * 0.95) - 1] * 1000:7.2f}ms "
+        f"last-turn={statistics.mean(last_turns) * 1000:7.2f}ms "
+        f"bytes/turn={total_bytes / turns / 1024:8.1f}KB checkpoints/turn={rows / turns:4.1f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Checkpoint I/O per turn")
+    parser.add_argument("--conversations", type=int, default=5)
+    parser.add_argument("--turns", type=int, default=30, help="Turns per conversation")
+    parser.add_argument("--steps", type=int, default=3, help="Tool round trips per turn")
+    parser.add_argument("--payload-kb", type=int, default=8, help="Size of each tool result")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="bottega-bench-") as workdir:
+        run("sqlite", False, args, workdir)
+        run("write-behind", True, args, workdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+# Latency benchmark for the order-placement path against the local Stripe stand-in
+#
+# Compares the previous payment-link flow (a one-off Price with inline
+# product_data followed by a PaymentLink) with PaymentLinkService (one
+# Checkout Session per order against a cached Product), and with
+# --full also times the place_order tool end to end on a scratch copy of the
+# database (SMS sending is replaced with a no-op).
+#
+#   python -m benchmarks.bench_order_placement --orders 200 --latency-ms 120 --full
+
+import argparse
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+import stripe
+
+from payments import PaymentLinkService, configure_stripe
+from stubs.stripe_server import StripeStub
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def legacy_payment_link(order_id, customer_id, order_type, total_amount):
+    price = stripe.Price.create(
+        unit_amount=int(total_amount * 100),
+        currency="usd",
+        product_data={"name": f"Order #{order_id} - Bottega Restaurant"},
+    )
+    payment_link = stripe.PaymentLink.create(
+        line_items=[{"price": price.id, "quantity": 1}],
+        after_completion={
+            "type": "redirect",
+            "redirect": {"url": f"https://yourwebsite.com/order-confirmation/{order_id}"},
+        },
+        metadata={"order_id": str(order_id), "customer_id": str(customer_id), "order_type": order_type},
+    )
+    return payment_link.url
+
+
+def summarize(name, timings, stub, orders):
+    timings = sorted(timings)
+    requests = sum(stub.requests.values())
+    print(
+        f"{name:<22} p50={statistics.median(timings) * 1000:7.1f}ms "
+        f"p95={timings[int(len(timings) * 0.95) - 1] * 1000:7.1f}ms "
+        f"mean={statistics.mean(timings) * 1000:7.1f}ms "
+        f"stripe_calls/order={requests / orders:4.2f} "
+        f"products={len(stub.products)} prices={len(stub.prices)}"
+    )
+
+
+def order_total(totals) -> float:
+    # Real totals are item prices plus tax, so they rarely repeat
+    return random.choice(totals) if totals else round(random.uniform(12, 120), 2)
+
+
+def run_payment_links(name, create, args, totals):
+    stub = StripeStub(latency=args.latency_ms / 1000).start()
+    configure_stripe("sk_test_bench", api_base=stub.base_url)
+    timings = []
+    for order_id in range(1, args.orders + 1):
+        start = time.perf_counter()
+        create(order_id, 1, "pickup", order_total(totals))
+        timings.append(time.perf_counter() - start)
+    summarize(name, timings, stub, args.orders)
+    stub.stop()
+
+
+def run_place_order(args):
+    stub = StripeStub(latency=args.latency_ms / 1000).start()
+    workdir = tempfile.mkdtemp(prefix="bottega-bench-")
+    shutil.copy(os.path.join(ROOT, "bottega_customer_chatbot.db"), workdir)
+    os.chdir(workdir)
+    os.environ.update({
+        "STRIPE_SECRET_KEY": "sk_test_bench",
+        "STRIPE_API_BASE": stub.base_url,
+        "TWILIO_ACCOUNT_SID": os.environ.get("TWILIO_ACCOUNT_SID", "AC_bench"),
+        "TWILIO_AUTH_TOKEN": os.environ.get("TWILIO_AUTH_TOKEN", "bench"),
+        "ANTHROPIC_API_KEY": os.environ.get("ANTHROPIC_API_KEY", "bench"),
+    })
+    import app
+    app.send_sms = lambda to, body: "SM_bench"
+
+    with app.get_db_connection() as conn:
+        item_ids = [row["ItemID"] for row in conn.execute("SELECT ItemID FROM MenuItems")]
+    app.create_or_update_customer.invoke({"name": "Bench Customer", "phone": "+14155550100"})
+    with app.get_db_connection() as conn:
+        customer_id = conn.execute("SELECT CustomerID FROM Customers WHERE Phone = '+14155550100'").fetchone()[0]
+
+    timings = []
+    for _ in range(args.orders):
+        for item_id in random.sample(item_ids, random.randint(1, 3)):
+            app.add_to_cart.invoke({"customer_id": customer_id, "item_id": item_id, "quantity": random.randint(1, 2)})
+        start = time.perf_counter()
+        result = app.place_order.invoke({"customer_id": customer_id, "order_type": "pickup"})
+        timings.append(time.perf_counter() - start)
+        if "Order placed successfully" not in result:
+            print(result, file=sys.stderr)
+            break
+    summarize("place_order", timings, stub, len(timings))
+    stub.stop()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Order placement latency benchmark")
+    parser.add_argument("--orders", type=int, default=100)
+    parser.add_argument("--latency-ms", type=float, default=100.0, help="Simulated Stripe latency per call")
+    parser.add_argument("--distinct-totals", type=int, default=0,
+                        help="Draw totals from this many distinct amounts (default: a fresh amount per order)")
+    parser.add_argument("--full", action="store_true", help="Also time the place_order tool end to end")
+    args = parser.parse_args()
+
+    random.seed(0)
+    totals = [round(random.uniform(12, 120) * 4) / 4 for _ in range(args.distinct_totals)]
+
+    run_payment_links("legacy (price + link)", legacy_payment_link, args, totals)
+    service, tenant = PaymentLinkService(), SimpleNamespace(tenant_id="default", name="Bottega Restaurant")
+    run_payment_links("PaymentLinkService", lambda *order: service.create_payment_link(*order, tenant), args, totals)
+    if args.full:
+        run_place_order(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,312 @@
+# Write-behind conversation checkpoints
+#
+# SqliteSaver serializes and writes the whole conversation state after every
+# graph step, and chat() reads it back with get_state(). WriteBehindSaver
+# keeps the latest checkpoint of recently active threads in memory: steps
+# within a turn only replace the in-memory checkpoint, and the latest one is
+# written to the underlying SqliteSaver when the turn ends (flush(thread_id)),
+# right after any step for which `flush_after(metadata)` is true (the app uses
+# it for steps that ran tools with side effects, such as place_order), or
+# every `flush_interval` seconds for anything still pending. Pending threads
+# are written together in one transaction.
+#
+# Crash recovery: the database always holds a checkpoint that was complete at
+# the time it was flushed, and a restarted process resumes each thread from
+# its last flushed checkpoint.
+# - chat() flushes before it responds, so every turn a customer got an answer
+#   for survives a crash.
+# - A step that ran a side-effecting tool is flushed as soon as it is put, so
+#   its tool results (an order placed, a payment link sent) are recorded even
+#   if the turn never finishes; a resent message sees them rather than
+#   repeating the action.
+# - Other steps of a turn in flight are lost. The interval flusher may have
+#   written some of them, so the checkpoint a thread resumes from can be from
+#   part-way through its last turn rather than from the end of the previous one.
+# Intermediate step checkpoints that are replaced before a flush are never
+# written, so a thread's history in the database has one checkpoint per
+# flush rather than one per step.
+
+from collections import OrderedDict
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Sequence, Tuple
+
+from langchain_core.messages import ToolMessage
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import BaseCheckpointSaver, Checkpoint, CheckpointMetadata, CheckpointTuple
+from langgraph.checkpoint.sqlite import SqliteSaver
+
+
+def wrote_tool_results(tool_names: Iterable[str]) -> Callable[[CheckpointMetadata], bool]:
+    """A `flush_after` predicate: true for steps that returned results of any of `tool_names`."""
+    tool_names = set(tool_names)
+
+    def predicate(metadata: CheckpointMetadata) -> bool:
+        for update in (metadata.get("writes") or {}).values():
+            messages = update.get("messages") if isinstance(update, dict) else None
+            if not isinstance(messages, list):
+                messages = [messages]
+            if any(isinstance(message, ToolMessage) and message.name in tool_names for message in messages):
+                return True
+        return False
+
+    return predicate
+
+
+class _HotThread:
+    """In-memory state of one thread: its latest checkpoint and what hasn't been written yet."""
+
+    def __init__(self, latest: CheckpointTuple, durable_ts: Optional[str]):
+        self.latest = latest
+        self.durable_ts = durable_ts
+        self.dirty = False
+        self.writes = {}
+        # Bumped on every change, so a flush can tell whether it wrote the newest state
+        self.version = 0
+        # Since the last turn_stats() call
+        self.puts = 0
+        self.put_seconds = 0.0
+        self.checkpoints_written = 0
+        self.bytes_written = 0
+        self.flush_seconds = 0.0
+
+    @property
+    def ts(self) -> str:
+        return self.latest.config["configurable"]["thread_ts"]
+
+
+class WriteBehindSaver(BaseCheckpointSaver):
+    """
+    Checkpoint saver that coalesces step checkpoints in memory and writes the
+    latest one per thread to `saver` in batches (see the module comment for
+    when, and for what a crash loses).
+
+    Threads with unwritten checkpoints are never evicted; the LRU can run over
+    `max_threads` by the number of turns in flight until they are flushed.
+    """
+
+    def __init__(self, saver: SqliteSaver, max_threads: int = 1000, flush_interval: float = 5.0,
+                 flush_after: Optional[Callable[[CheckpointMetadata], bool]] = None):
+        super().__init__(serde=saver.serde)
+        self.saver = saver
+        self.max_threads = max_threads
+        self.flush_interval = flush_interval
+        self.flush_after = flush_after
+        self._threads = OrderedDict()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._flusher = None
+        self.stats_totals = {
+            "puts": 0,
+            "step_flushes": 0,
+            "flushes": 0,
+            "checkpoints_written": 0,
+            "bytes_written": 0,
+            "flush_seconds": 0.0,
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+        }
+
+    @property
+    def config_specs(self):
+        return self.saver.config_specs
+
+    def get_next_version(self, current, channel):
+        return self.saver.get_next_version(current, channel)
+
+    # Background flushing
+
+    def start(self):
+        if self._flusher is None and self.flush_interval > 0:
+            self._flusher = threading.Thread(target=self._run, name="checkpoint-flusher", daemon=True)
+            self._flusher.start()
+        return self
+
+    def stop(self):
+        """Stop the interval flusher and write everything still pending."""
+        self._stopped.set()
+        self.flush()
+
+    def _run(self):
+        while not self._stopped.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f"Checkpoint flush failed: {str(e)}")
+
+    # Reads
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        thread_id = str(config["configurable"]["thread_id"])
+        thread_ts = config["configurable"].get("thread_ts")
+        with self._lock:
+            hot = self._threads.get(thread_id)
+            if hot is not None and (thread_ts is None or thread_ts == hot.ts):
+                self._threads.move_to_end(thread_id)
+                self.stats_totals["hits"] += 1
+                return hot.latest._replace(pending_writes=self._pending_writes(hot))
+            self.stats_totals["misses"] += 1
+        saved = self.saver.get_tuple(config)
+        if saved is not None and thread_ts is None:
+            hot = _HotThread(saved, saved.config["configurable"]["thread_ts"])
+            for task_id, channel, value in saved.pending_writes or []:
+                hot.writes[(task_id, sum(1 for key in hot.writes if key[0] == task_id))] = (channel, value)
+            with self._lock:
+                if thread_id not in self._threads:
+                    self._insert(thread_id, hot)
+        return saved
+
+    def list(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> Iterator[CheckpointTuple]:
+        # History comes from the database, so make this thread's part of it current first
+        self.flush(str(config["configurable"]["thread_id"]) if config else None)
+        return self.saver.list(config, filter=filter, before=before, limit=limit)
+
+    @staticmethod
+    def _pending_writes(hot: _HotThread) -> list:
+        return [(task_id, channel, value) for (task_id, _), (channel, value) in sorted(hot.writes.items())]
+
+    # Writes
+
+    def put(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata) -> RunnableConfig:
+        started = time.monotonic()
+        thread_id = str(config["configurable"]["thread_id"])
+        saved_config = {"configurable": {"thread_id": config["configurable"]["thread_id"], "thread_ts": checkpoint["id"]}}
+        parent_ts = config["configurable"].get("thread_ts")
+        latest = CheckpointTuple(
+            saved_config,
+            checkpoint,
+            metadata,
+            {"configurable": {"thread_id": thread_id, "thread_ts": parent_ts}} if parent_ts else None,
+        )
+        with self._lock:
+            hot = self._threads.get(thread_id)
+            if hot is None:
+                # A thread we haven't seen (or evicted): its parent is whatever the database has.
+                hot = _HotThread(latest, parent_ts)
+                hot.dirty = True
+                self._insert(thread_id, hot)
+            else:
+                self._threads.move_to_end(thread_id)
+                hot.latest = latest
+                hot.writes = {}
+            hot.dirty = True
+            hot.version += 1
+            hot.puts += 1
+            hot.put_seconds += time.monotonic() - started
+            self.stats_totals["puts"] += 1
+        if self.flush_after is not None and self.flush_after(metadata):
+            self.flush(thread_id)
+            with self._lock:
+                self.stats_totals["step_flushes"] += 1
+        return saved_config
+
+    def put_writes(self, config: RunnableConfig, writes: Sequence[Tuple[str, Any]], task_id: str) -> None:
+        thread_id = str(config["configurable"]["thread_id"])
+        with self._lock:
+            hot = self._threads.get(thread_id)
+            if hot is not None and config["configurable"].get("thread_ts") == hot.ts:
+                for idx, write in enumerate(writes):
+                    hot.writes[(task_id, idx)] = write
+                hot.dirty = True
+                hot.version += 1
+                return
+        self.saver.put_writes(config, writes, task_id)
+
+    def _insert(self, thread_id: str, hot: _HotThread):
+        self._threads[thread_id] = hot
+        excess = len(self._threads) - self.max_threads
+        for old_id in [tid for tid, old in self._threads.items() if not old.dirty and tid != thread_id][:max(excess, 0)]:
+            del self._threads[old_id]
+            self.stats_totals["evictions"] += 1
+
+    # Flushing
+
+    def flush(self, thread_id: Optional[str] = None) -> int:
+        """Write the pending checkpoint of `thread_id`, or of every thread, in one transaction. Returns bytes written."""
+        with self._flush_lock:
+            with self._lock:
+                if thread_id is not None:
+                    hot = self._threads.get(thread_id)
+                    threads = [(thread_id, hot)] if hot is not None and hot.dirty else []
+                else:
+                    threads = [(tid, hot) for tid, hot in self._threads.items() if hot.dirty]
+                pending = [(tid, hot, hot.version, hot.latest, dict(hot.writes), hot.durable_ts) for tid, hot in threads]
+            if not pending:
+                return 0
+
+            # Serialize and write without holding up puts from other threads
+            started = time.monotonic()
+            checkpoint_rows, write_rows, sizes = [], [], []
+            for thread_id, _, _, latest, writes, durable_ts in pending:
+                thread_ts = latest.config["configurable"]["thread_ts"]
+                checkpoint_blob = self.serde.dumps(latest.checkpoint)
+                metadata_blob = self.serde.dumps(latest.metadata)
+                checkpoint_rows.append((thread_id, thread_ts, durable_ts, checkpoint_blob, metadata_blob))
+                size = len(checkpoint_blob) + len(metadata_blob)
+                for (task_id, idx), (channel, value) in writes.items():
+                    value_blob = self.serde.dumps(value)
+                    write_rows.append((thread_id, thread_ts, task_id, idx, channel, value_blob))
+                    size += len(value_blob)
+                sizes.append(size)
+
+            with self.saver.lock, self.saver.cursor() as cur:
+                cur.executemany(
+                    "INSERT OR REPLACE INTO checkpoints (thread_id, thread_ts, parent_ts, checkpoint, metadata) VALUES (?, ?, ?, ?, ?)",
+                    checkpoint_rows,
+                )
+                if write_rows:
+                    cur.executemany(
+                        "INSERT OR REPLACE INTO writes (thread_id, thread_ts, task_id, idx, channel, value) VALUES (?, ?, ?, ?, ?, ?)",
+                        write_rows,
+                    )
+            elapsed = time.monotonic() - started
+
+            with self._lock:
+                for (_, hot, version, latest, _, _), size in zip(pending, sizes):
+                    hot.durable_ts = latest.config["configurable"]["thread_ts"]
+                    if hot.version == version:
+                        hot.dirty = False
+                    hot.checkpoints_written += 1
+                    hot.bytes_written += size
+                    hot.flush_seconds += elapsed / len(pending)
+                total = sum(sizes)
+                self.stats_totals["flushes"] += 1
+                self.stats_totals["checkpoints_written"] += len(pending)
+                self.stats_totals["bytes_written"] += total
+                self.stats_totals["flush_seconds"] += elapsed
+            return total
+
+    def turn_stats(self, thread_id: str) -> dict:
+        """Checkpoint work for `thread_id` since the previous call, for per-turn metrics."""
+        with self._lock:
+            hot = self._threads.get(thread_id)
+            if hot is None:
+                return {}
+            stats = {
+                "checkpoint_puts": hot.puts,
+                "checkpoints_written": hot.checkpoints_written,
+                "checkpoint_bytes": hot.bytes_written,
+                "checkpoint_seconds": hot.put_seconds + hot.flush_seconds,
+            }
+            hot.puts = hot.checkpoints_written = hot.bytes_written = 0
+            hot.put_seconds = hot.flush_seconds = 0.0
+            return stats
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                **self.stats_totals,
+                "hot_threads": len(self._threads),
+                "dirty_threads": sum(1 for hot in self._threads.values() if hot.dirty),
+                "max_threads": self.max_threads,
+            }
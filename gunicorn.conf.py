@@ -0,0 +1,22 @@
+# Production server settings: gunicorn -c gunicorn.conf.py app:app
+#
+# gevent workers serve each connection from a greenlet instead of an OS
+# thread, so thousands of idle order-status subscribers (SSE and long-poll)
+# and static file requests don't tie up threads that /chat turns need.
+# Keep a single worker: conversation checkpoints, admission control and the
+# status feeds live in process memory.
+
+import os
+
+bind = f"0.0.0.0:{os.environ.get('FLASK_PORT', 10000)}"
+workers = 1
+worker_class = "gevent"
+worker_connections = int(os.environ.get("WORKER_CONNECTIONS", 5000))
+# Turns are bounded by the assistant's turn budget; this only catches a hung worker
+timeout = int(os.environ.get("WORKER_TIMEOUT", 120))
+graceful_timeout = 30
+keepalive = 5
+accesslog = "-"
+# The default format logs the full request line; status tokens travel in the
+# query string, so log the path only.
+access_log_format = '%(h)s %(l)s %(u)s %(t)s "%(m)s %(U)s %(H)s" %(s)s %(b)s "%(f)s" "%(a)s"'
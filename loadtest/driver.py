@@ -0,0 +1,80 @@
+# Concurrent ordering sessions against /chat
+#
+# Each session walks through a full ordering conversation (introduce
+# yourself, browse the menu, add an item, place the order, check its status)
+# on its own thread_id, timing every turn. A turn turned away with 429 is
+# recorded and sent again after its Retry-After, as the web client would.
+
+from concurrent.futures import ThreadPoolExecutor
+import random
+import time
+
+import requests
+
+
+def session_messages(index: int, item_ids: list) -> list:
+    """The user side of one scripted ordering conversation."""
+    rng = random.Random(index)
+    return [
+        f"Hi, I'm Load Tester {index} and my phone is +1415{5000000 + index:07d}",
+        f"Can I see the menu? category {rng.randint(1, 3)}",
+        f"Please add item {rng.choice(item_ids)} x{rng.randint(1, 3)}",
+        f"That's all, please place a {rng.choice(['pickup', 'delivery'])} order",
+        "What's the status of my order?",
+        "thanks!",
+    ]
+
+
+MAX_ATTEMPTS = 3
+
+
+def run_session(base_url: str, run_id: str, index: int, item_ids: list, think_time: float, timeout: float) -> list:
+    thread_id = f"loadtest-{run_id}-{index}"
+    records = []
+    with requests.Session() as http:
+        for turn, message in enumerate(session_messages(index, item_ids)):
+            for attempt in range(1, MAX_ATTEMPTS + 1):
+                started = time.perf_counter()
+                record = {"session": index, "turn": turn, "attempt": attempt, "started": time.time()}
+                try:
+                    response = http.post(f"{base_url}/chat", json={"message": message, "thread_id": thread_id}, timeout=timeout)
+                    record["status"] = response.status_code
+                    body = response.json() if response.headers.get("Content-Type", "").startswith("application/json") else {}
+                    if response.status_code != 200:
+                        record["error"] = body.get("error") or f"HTTP {response.status_code}"
+                    elif not body.get("messages"):
+                        record["error"] = "empty reply"
+                except requests.RequestException as e:
+                    record["status"] = None
+                    record["error"] = type(e).__name__
+                    response = None
+                record["latency"] = time.perf_counter() - started
+                records.append(record)
+                if record["status"] != 429 or attempt == MAX_ATTEMPTS:
+                    break
+                retry_after = float(response.headers.get("Retry-After", 1))
+                record["retry_after"] = retry_after
+                time.sleep(retry_after)
+            if record.get("error"):
+                break  # The rest of the conversation depends on this turn.
+            if think_time:
+                time.sleep(random.uniform(0.5, 1.5) * think_time)
+    return records
+
+
+def run_sessions(base_url: str, run_id: str, sessions: int, concurrency: int, item_ids: list,
+                 think_time: float = 0.0, ramp_up: float = 0.0, timeout: float = 120.0) -> dict:
+    """Run `sessions` conversations, `concurrency` at a time. Returns turn records and wall time."""
+    def start(index):
+        if ramp_up and index < concurrency:
+            time.sleep(ramp_up * index / concurrency)
+        return run_session(base_url, run_id, index, item_ids, think_time, timeout)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(start, range(sessions)))
+    return {
+        "records": [record for session in results for record in session],
+        "completed_sessions": sum(1 for session in results if session and not session[-1].get("error")),
+        "wall_seconds": time.perf_counter() - started,
+    }
@@ -0,0 +1,113 @@
+# Load test summaries and run-to-run comparison
+#
+#   python -m loadtest.report loadtest/results/<before>.json loadtest/results/<after>.json
+
+import argparse
+from collections import Counter
+import json
+import math
+
+
+def percentile(values: list, pct: float) -> float:
+    """Nearest-rank percentile; 0.0 for an empty list."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def summarize(records: list, wall_seconds: float, completed_sessions: int, sessions: int) -> dict:
+    ok = [r["latency"] for r in records if not r.get("error")]
+    errors = Counter(r["error"] for r in records if r.get("error"))
+    statuses = Counter(str(r["status"]) for r in records)
+    per_turn = {}
+    for turn in sorted({r["turn"] for r in records}):
+        latencies = [r["latency"] for r in records if r["turn"] == turn and not r.get("error")]
+        per_turn[str(turn)] = {"count": len(latencies), "p50": percentile(latencies, 50), "p95": percentile(latencies, 95)}
+    return {
+        "turns": len(records),
+        "successful_turns": len(ok),
+        "error_rate": (len(records) - len(ok)) / len(records) if records else 0.0,
+        "errors": dict(errors),
+        "statuses": dict(statuses),
+        "sessions": sessions,
+        "completed_sessions": completed_sessions,
+        "throughput_turns_per_second": len(ok) / wall_seconds if wall_seconds else 0.0,
+        "throughput_sessions_per_second": completed_sessions / wall_seconds if wall_seconds else 0.0,
+        "latency": {
+            "p50": percentile(ok, 50),
+            "p95": percentile(ok, 95),
+            "p99": percentile(ok, 99),
+            "max": max(ok, default=0.0),
+        },
+        "latency_by_turn": per_turn,
+    }
+
+
+def print_summary(result: dict):
+    config, summary = result["config"], result["summary"]
+    latency = summary["latency"]
+    print(f"Run {result['run_id']}: {config['sessions']} sessions, concurrency {config['concurrency']}, "
+          f"LLM latency {config.get('llm_latency_ms')}ms")
+    print(f"  turns: {summary['successful_turns']}/{summary['turns']} ok, error rate {summary['error_rate']:.1%} "
+          f"{summary['errors'] or ''}")
+    print(f"  throughput: {summary['throughput_turns_per_second']:.2f} turns/s, "
+          f"{summary['throughput_sessions_per_second']:.2f} sessions/s")
+    print(f"  turn latency: p50 {latency['p50']:.2f}s  p95 {latency['p95']:.2f}s  "
+          f"p99 {latency['p99']:.2f}s  max {latency['max']:.2f}s")
+    turns = result.get("server", {}).get("turns_delta") or {}
+    if turns.get("turns") and "checkpoint_bytes" in turns:
+        print(f"  checkpoints: {turns['checkpoint_bytes'] / turns['turns'] / 1024:.1f}KB and "
+              f"{turns['checkpoint_seconds'] / turns['turns'] * 1000:.1f}ms per turn")
+    rejected = summary["statuses"].get("429", 0)
+    if rejected:
+        print(f"  admission: {rejected} turns answered 429 and retried after Retry-After")
+    sqlite = result.get("server", {}).get("sqlite_delta")
+    if sqlite is not None:
+        print(f"  sqlite: {sqlite.get('busy', 0)} busy/locked ({sqlite.get('checkpoint_busy', 0)} on checkpoints), "
+              f"{sqlite.get('errors', 0)} errors; checkpoint lock waited {sqlite.get('checkpoint_lock_waits', 0)} times, "
+              f"{sqlite.get('checkpoint_lock_wait_seconds', 0.0) * 1000:.1f}ms in total")
+
+
+COMPARED = [
+    ("throughput turns/s", lambda r: r["summary"]["throughput_turns_per_second"]),
+    ("p50 latency s", lambda r: r["summary"]["latency"]["p50"]),
+    ("p95 latency s", lambda r: r["summary"]["latency"]["p95"]),
+    ("p99 latency s", lambda r: r["summary"]["latency"]["p99"]),
+    ("error rate", lambda r: r["summary"]["error_rate"]),
+    ("sqlite busy", lambda r: (r.get("server", {}).get("sqlite_delta") or {}).get("busy", 0)),
+    ("checkpoint lock wait s", lambda r: r["server"]["sqlite_delta"]["checkpoint_lock_wait_seconds"]),
+]
+
+
+def compare(results: list):
+    names = [r["run_id"] for r in results]
+    print(f"{'':<22}" + "".join(f"{name:>24}" for name in names))
+    for label, metric in COMPARED:
+        values = []
+        for r in results:
+            try:
+                values.append(f"{metric(r):>24.3f}")
+            except (KeyError, TypeError):
+                values.append(f"{'-':>24}")
+        print(f"{label:<22}" + "".join(values))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize or compare saved load test runs")
+    parser.add_argument("results", nargs="+", help="Result JSON files written by loadtest.run")
+    args = parser.parse_args()
+
+    results = []
+    for path in args.results:
+        with open(path) as f:
+            results.append(json.load(f))
+    if len(results) == 1:
+        print_summary(results[0])
+    else:
+        compare(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+# Load test runner
+#
+# Starts the Anthropic, Stripe and Twilio stand-ins, launches app.py on a
+# scratch copy of the databases with its providers pointed at them, drives
+# concurrent ordering sessions against /chat and saves a JSON report under
+# loadtest/results/ for comparison with later runs.
+#
+#   python -m loadtest.run --sessions 200 --concurrency 40 --llm-latency-ms 800
+#
+# Pass --url to drive an app you started yourself (it should already be
+# pointed at the stand-ins or at real providers), or --gunicorn to serve it
+# the way the container does instead of with the Flask dev server.
+
+import argparse
+from datetime import datetime
+import json
+import os
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+from loadtest.driver import run_sessions
+from loadtest.report import print_summary, summarize
+from stubs.anthropic_server import AnthropicStub
+from stubs.stripe_server import StripeStub
+from stubs.twilio_server import TwilioStub
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, "loadtest", "results")
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def fetch_metrics(base_url: str) -> dict:
+    try:
+        return requests.get(f"{base_url}/metrics", timeout=5).json()
+    except (requests.RequestException, ValueError):
+        return {}
+
+
+def wait_until_ready(base_url: str, process, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"app.py exited with code {process.returncode}; see its output log")
+        if fetch_metrics(base_url):
+            return
+        time.sleep(0.25)
+    raise RuntimeError(f"app.py did not become ready at {base_url}")
+
+
+def start_app(workdir: str, stubs: dict, extra_env: dict, gunicorn: bool = False):
+    shutil.copy(os.path.join(ROOT, "bottega_customer_chatbot.db"), workdir)
+    port = free_port()
+    env = {
+        **os.environ,
+        "FLASK_PORT": str(port),
+        "ANTHROPIC_API_KEY": "sk-ant-loadtest",
+        "ANTHROPIC_API_URL": stubs["anthropic"].base_url,
+        "STRIPE_SECRET_KEY": "sk_test_loadtest",
+        "STRIPE_API_BASE": stubs["stripe"].base_url,
+        "TWILIO_ACCOUNT_SID": "AC_loadtest",
+        "TWILIO_AUTH_TOKEN": "loadtest",
+        "TWILIO_API_BASE": stubs["twilio"].base_url,
+        "LANGCHAIN_TRACING_V2": "false",
+        # Every session comes from this machine's address, and a scripted
+        # session sends its turns back to back, faster than any customer types
+        "ADMISSION_CLIENT_RATE": "1000",
+        "ADMISSION_CLIENT_BURST": "1000",
+        "ADMISSION_THREAD_RATE": "1000",
+        "ADMISSION_THREAD_BURST": "1000",
+        **extra_env,
+    }
+    log = open(os.path.join(workdir, "app_output.log"), "w")
+    if gunicorn:
+        command = [sys.executable, "-m", "gunicorn", "-c", os.path.join(ROOT, "gunicorn.conf.py"),
+                   "--pythonpath", ROOT, "app:app"]
+    else:
+        command = [sys.executable, os.path.join(ROOT, "app.py")]
+    process = subprocess.Popen(
+        command,
+        cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+    return process, f"http://127.0.0.1:{port}"
+
+
+def menu_item_ids(db_path: str) -> list:
+    conn = sqlite3.connect(db_path)
+    try:
+        return [row[0] for row in conn.execute("SELECT ItemID FROM MenuItems")]
+    finally:
+        conn.close()
+
+
+def metrics_delta(before: dict, after: dict) -> dict:
+    return {key: after.get(key, 0) - before.get(key, 0) for key in after if isinstance(after.get(key), (int, float))}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end load test for /chat")
+    parser.add_argument("--sessions", type=int, default=50, help="Total ordering sessions to run")
+    parser.add_argument("--concurrency", type=int, default=10, help="Sessions in flight at once")
+    parser.add_argument("--think-ms", type=float, default=0.0, help="Mean pause between a session's turns")
+    parser.add_argument("--ramp-up", type=float, default=0.0, help="Seconds over which to start the first wave")
+    parser.add_argument("--llm-latency-ms", type=float, default=800.0)
+    parser.add_argument("--stripe-latency-ms", type=float, default=150.0)
+    parser.add_argument("--twilio-latency-ms", type=float, default=200.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Injected LLM error rate")
+    parser.add_argument("--url", help="Drive an already running app instead of starting one")
+    parser.add_argument("--gunicorn", action="store_true", help="Serve the app with gunicorn.conf.py")
+    parser.add_argument("--env", action="append", default=[], metavar="NAME=VALUE", help="Extra app environment")
+    parser.add_argument("--label", default="", help="Suffix for the result file name")
+    parser.add_argument("--keep-workdir", action="store_true")
+    args = parser.parse_args()
+
+    run_id = datetime.now().strftime("%Y%m%d-%H%M%S") + (f"-{args.label}" if args.label else "")
+    stubs = {
+        "anthropic": AnthropicStub(latency=args.llm_latency_ms / 1000, error_rate=args.error_rate).start(),
+        "stripe": StripeStub(latency=args.stripe_latency_ms / 1000).start(),
+        "twilio": TwilioStub(latency=args.twilio_latency_ms / 1000).start(),
+    }
+    workdir = tempfile.mkdtemp(prefix="bottega-loadtest-")
+    process = None
+    try:
+        if args.url:
+            base_url = args.url.rstrip("/")
+        else:
+            extra_env = dict(item.split("=", 1) for item in args.env)
+            process, base_url = start_app(workdir, stubs, extra_env, args.gunicorn)
+        wait_until_ready(base_url, process)
+        print(f"Driving {args.sessions} sessions ({args.concurrency} concurrent) against {base_url}")
+
+        before = fetch_metrics(base_url)
+        outcome = run_sessions(
+            base_url, run_id, args.sessions, args.concurrency,
+            menu_item_ids(os.path.join(ROOT, "bottega_customer_chatbot.db")),
+            think_time=args.think_ms / 1000, ramp_up=args.ramp_up,
+        )
+        after = fetch_metrics(base_url)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=10)
+        for stub in stubs.values():
+            stub.stop()
+
+    result = {
+        "run_id": run_id,
+        "config": {
+            "sessions": args.sessions,
+            "concurrency": args.concurrency,
+            "think_ms": args.think_ms,
+            "llm_latency_ms": args.llm_latency_ms,
+            "stripe_latency_ms": args.stripe_latency_ms,
+            "twilio_latency_ms": args.twilio_latency_ms,
+            "error_rate": args.error_rate,
+            "env": args.env,
+            "gunicorn": args.gunicorn,
+        },
+        "summary": summarize(outcome["records"], outcome["wall_seconds"], outcome["completed_sessions"], args.sessions),
+        "server": {
+            "sqlite_delta": metrics_delta(before.get("sqlite", {}), after.get("sqlite", {})),
+            "turns_delta": metrics_delta(before.get("turns", {}), after.get("turns", {})),
+            "metrics_after": after,
+        },
+        "provider_calls": {name: sum(stub.requests.values()) for name, stub in stubs.items()},
+        "records": outcome["records"],
+    }
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, f"{run_id}.json")
+    with open(path, "w") as f:
+        json.dump(result, f, indent=2)
+    print_summary(result)
+    print(f"Saved {path}")
+
+    if args.keep_workdir:
+        print(f"App working directory (databases, logs): {workdir}")
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+# Per-turn metrics
+#
+# A turn is one /chat request: it may run several graph steps (assistant,
+# tools, assistant again, ...). Components add counters for the turn keyed by
+# thread_id; when the turn finishes the counters are logged and folded into
+# process-wide totals that /metrics exports.
+
+from collections import defaultdict
+import logging
+import threading
+import time
+
+
+class TurnMetrics:
+    """Counters for in-progress turns, keyed by thread_id, plus running totals."""
+
+    def __init__(self):
+        self._turns = {}
+        self._totals = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def start(self, thread_id: str) -> dict:
+        turn = {"started": time.monotonic()}
+        with self._lock:
+            self._turns[thread_id] = turn
+        return turn
+
+    def started(self, thread_id: str) -> float:
+        """Monotonic start time of the thread's current turn (now, if none is in progress)."""
+        with self._lock:
+            turn = self._turns.get(thread_id)
+            return turn["started"] if turn else time.monotonic()
+
+    def add(self, thread_id: str, **increments):
+        with self._lock:
+            turn = self._turns.get(thread_id)
+            if turn is None:
+                return
+            for name, value in increments.items():
+                turn[name] = turn.get(name, 0) + value
+
+    def finish(self, thread_id: str) -> dict:
+        with self._lock:
+            turn = self._turns.pop(thread_id, None)
+            if turn is None:
+                return {}
+            turn["turn_seconds"] = time.monotonic() - turn.pop("started")
+            self._totals["turns"] += 1
+            for name, value in turn.items():
+                self._totals[name] += value
+        logging.info(f"Turn metrics for thread {thread_id}: " + ", ".join(
+            f"{name}={value:.3f}" if isinstance(value, float) else f"{name}={value}"
+            for name, value in sorted(turn.items())
+        ))
+        return turn
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"in_progress": len(self._turns), **self._totals}
+
+
+turn_metrics = TurnMetrics()
@@ -0,0 +1,286 @@
+# Order status materialization and change feed
+#
+# OrderStatus stays the append-only history. Orders.CurrentStatus holds the
+# latest status so lookups don't have to scan the log, and a trigger keeps it
+# in sync in the same transaction as every appended status row.
+#
+# OrderStatusFeed turns new OrderStatus rows into events that the SSE and
+# long-poll endpoints hand out to customers and the kitchen screen, so
+# checking on an order no longer costs an LLM turn.
+#
+# Order IDs are sequential, so following one order takes a status token: an
+# HMAC of the location and order ID, sent to the customer with the order. The
+# kitchen's all-orders stream takes a short-lived token of the same kind,
+# fetched with the kitchen key in a header, so the key itself never appears
+# in a URL (EventSource can't send headers).
+
+import base64
+from collections import deque
+import hashlib
+import hmac
+import logging
+import sqlite3
+import threading
+import time
+
+
+ORDER_STATUS_TRIGGER = """
+    CREATE TRIGGER IF NOT EXISTS trg_orderstatus_current
+    AFTER INSERT ON OrderStatus
+    BEGIN
+        UPDATE Orders
+        SET CurrentStatus = NEW.Status,
+            UpdatedAt = NEW.UpdatedAt
+        WHERE OrderID = NEW.OrderID;
+    END
+"""
+
+
+def ensure_order_status_schema(db_path: str) -> None:
+    """
+    Add the Orders.CurrentStatus column and its maintenance trigger if missing,
+    backfilling existing orders from the OrderStatus log. Safe to run on every start.
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        with conn:
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(Orders)")}
+            if "CurrentStatus" not in columns:
+                conn.execute("ALTER TABLE Orders ADD COLUMN CurrentStatus TEXT")
+                conn.execute("""
+                    UPDATE Orders
+                    SET CurrentStatus = (
+                        SELECT os.Status FROM OrderStatus os
+                        WHERE os.OrderID = Orders.OrderID
+                        ORDER BY os.UpdatedAt DESC, os.StatusID DESC
+                        LIMIT 1
+                    )
+                """)
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_orderstatus_order ON OrderStatus (OrderID, StatusID)"
+            )
+            conn.execute(ORDER_STATUS_TRIGGER)
+    finally:
+        conn.close()
+
+
+def append_order_status(cursor, order_id: int, status: str) -> int:
+    """
+    Append a status row for an order. The trigger updates Orders.CurrentStatus
+    within the caller's transaction; the caller is responsible for committing.
+    Returns the new StatusID, which doubles as the feed event ID.
+    """
+    cursor.execute("INSERT INTO OrderStatus (OrderID, Status) VALUES (?, ?)", (order_id, status))
+    return cursor.lastrowid
+
+
+def sign_status_token(secret: str, subject: str, expires: int = 0) -> str:
+    """
+    A token for `subject` (see order_status_subject / kitchen_status_subject),
+    valid until the Unix time `expires`, or for good if it is 0.
+    """
+    digest = hmac.new(secret.encode(), f"{subject}|{expires}".encode(), hashlib.sha256).digest()
+    return f"{expires}.{base64.urlsafe_b64encode(digest).decode().rstrip('=')}"
+
+
+def check_status_token(secret: str, subject: str, token: str) -> bool:
+    """True if `token` was signed for `subject` with `secret` and hasn't expired. Fails closed without a secret."""
+    if not secret or not token:
+        return False
+    expires, _, _ = token.partition(".")
+    if not expires.isdigit() or (int(expires) and int(expires) < time.time()):
+        return False
+    return hmac.compare_digest(token.encode(), sign_status_token(secret, subject, int(expires)).encode())
+
+
+def order_status_subject(tenant_id: str, order_id: int) -> str:
+    return f"order:{tenant_id}:{order_id}"
+
+
+def kitchen_status_subject(tenant_id: str) -> str:
+    return f"kitchen:{tenant_id}"
+
+
+class _Subscriber:
+    def __init__(self, order_id):
+        self.order_id = order_id
+        self.ready = threading.Event()
+
+
+class OrderStatusFeed:
+    """
+    Fan-out of OrderStatus changes to many idle subscribers.
+
+    A single watcher thread tails OrderStatus by StatusID (so writes from other
+    processes are picked up too) and keeps the most recent events in a ring
+    buffer. Waiting subscribers are kept in wait lists by order ID (None for
+    the all-orders feed), so a status change wakes only the subscribers of
+    that order and of the all-orders feed, and each of them reads only the
+    events newer than what it has seen. Subscribers never touch the database
+    unless they have fallen behind the buffer.
+    """
+
+    def __init__(self, db_path: str, poll_interval: float = 1.0, buffer_size: int = 1000):
+        self.db_path = db_path
+        self.poll_interval = poll_interval
+        self._events = deque(maxlen=buffer_size)
+        self._lock = threading.Lock()
+        self._waiting = {}
+        self._wake = threading.Event()
+        self._last_id = 0
+        self._thread = None
+        self._stopped = False
+        self.subscribers = 0
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._last_id = self._query_max_id()
+        self._thread = threading.Thread(target=self._run, name="order-status-feed", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the watcher thread; waiting subscribers are released with no events."""
+        self._stopped = True
+        self._wake.set()
+        with self._lock:
+            waiting = [subscriber for subscribers in self._waiting.values() for subscriber in subscribers]
+        for subscriber in waiting:
+            subscriber.ready.set()
+
+    @property
+    def stopped(self) -> bool:
+        return self._stopped
+
+    def notify(self):
+        """Ask the watcher to poll now, e.g. right after this process appended a status."""
+        self._wake.set()
+
+    @property
+    def last_event_id(self) -> int:
+        return self._last_id
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _query_max_id(self) -> int:
+        conn = self._connect()
+        try:
+            return conn.execute("SELECT COALESCE(MAX(StatusID), 0) FROM OrderStatus").fetchone()[0]
+        finally:
+            conn.close()
+
+    def _query_since(self, since: int, order_id=None, limit: int = 500) -> list:
+        conn = self._connect()
+        try:
+            sql = """
+                SELECT StatusID, OrderID, Status, UpdatedAt
+                FROM OrderStatus
+                WHERE StatusID > ?
+            """
+            params = [since]
+            if order_id is not None:
+                sql += " AND OrderID = ?"
+                params.append(order_id)
+            sql += " ORDER BY StatusID LIMIT ?"
+            params.append(limit)
+            return [self._to_event(row) for row in conn.execute(sql, params)]
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _to_event(row) -> dict:
+        return {
+            "id": row["StatusID"],
+            "order_id": row["OrderID"],
+            "status": row["Status"],
+            "updated_at": row["UpdatedAt"],
+        }
+
+    def _run(self):
+        while not self._stopped:
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            if self._stopped:
+                break
+            try:
+                new_events = self._query_since(self._last_id)
+            except sqlite3.Error as e:
+                logging.error(f"Order status feed poll failed: {str(e)}")
+                continue
+            if not new_events:
+                continue
+            with self._lock:
+                self._events.extend(new_events)
+                self._last_id = new_events[-1]["id"]
+                woken = list(self._waiting.get(None, ()))
+                for order_id in {event["order_id"] for event in new_events}:
+                    woken.extend(self._waiting.get(order_id, ()))
+            for subscriber in woken:
+                subscriber.ready.set()
+
+    def _buffered_since(self, since: int, order_id=None) -> list:
+        events = []
+        for event in reversed(self._events):
+            if event["id"] <= since:
+                break
+            if order_id is None or event["order_id"] == order_id:
+                events.append(event)
+        events.reverse()
+        return events
+
+    def wait_for_events(self, since: int, order_id=None, timeout: float = 25.0) -> list:
+        """
+        Return events with an ID greater than `since`, optionally for one order,
+        blocking up to `timeout` seconds until at least one is available.
+        """
+        deadline = time.monotonic() + timeout
+        subscriber = _Subscriber(order_id)
+        with self._lock:
+            self.subscribers += 1
+            self._waiting.setdefault(order_id, set()).add(subscriber)
+        try:
+            while True:
+                with self._lock:
+                    oldest = self._events[0]["id"] if self._events else self._last_id + 1
+                    behind = since < oldest - 1 and since < self._last_id
+                    if behind:
+                        caught_up_to = self._last_id
+                    else:
+                        events = self._buffered_since(since, order_id)
+                        if events:
+                            return events
+                        # Nothing relevant up to the newest event; don't rescan it.
+                        since = max(since, self._last_id)
+                        # Cleared under the lock, so an event appended from here on sets it again
+                        subscriber.ready.clear()
+                if behind:
+                    # Fell behind the ring buffer; catch up from the log. Everything up to
+                    # caught_up_to was already in the log, so if nothing comes back the
+                    # subscriber has seen it all and waits like any other.
+                    events = self._query_since(since, order_id)
+                    if events:
+                        return events
+                    since = max(since, caught_up_to)
+                    continue
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self._stopped:
+                    return []
+                subscriber.ready.wait(remaining)
+        finally:
+            with self._lock:
+                self.subscribers -= 1
+                waiting = self._waiting[order_id]
+                waiting.discard(subscriber)
+                if not waiting:
+                    del self._waiting[order_id]
+
+    def stats(self) -> dict:
+        return {
+            "last_event_id": self._last_id,
+            "buffered_events": len(self._events),
+            "subscribers": self.subscribers,
+            "waiting_orders": len(self._waiting),
+        }
@@ -0,0 +1,112 @@
+# Stripe payment links for orders
+#
+# Every order used to create a one-off Price (with an inline Product) and then
+# a PaymentLink: two sequential calls per order and an ever-growing pile of
+# Prices and Products in the Stripe account. Payment Links only take an
+# existing Price, and order totals rarely repeat, so PaymentLinkService creates
+# a Checkout Session instead: its line item carries the order total as
+# `price_data` against a Product that is looked up once per process, so every
+# order is a single call and the customer sees one "<location> Order" line for
+# the real amount. Checkout Sessions expire (after 24 hours by default, see
+# STRIPE_CHECKOUT_EXPIRY_HOURS), unlike Payment Links.
+#
+# Locations share the Stripe account but number their orders independently,
+# so each location gets its own Product (`<STRIPE_PRODUCT_ID>-<tenant_id>`),
+# and the tenant ID is part of every idempotency key and of the metadata.
+
+import logging
+import os
+import threading
+import time
+
+import stripe
+
+
+STRIPE_TIMEOUT = float(os.environ.get("STRIPE_TIMEOUT", 5))
+STRIPE_MAX_RETRIES = int(os.environ.get("STRIPE_MAX_RETRIES", 2))
+STRIPE_PRODUCT_ID = os.environ.get("STRIPE_PRODUCT_ID", "bottega-order")
+# Stripe allows 0.5 to 24 hours
+STRIPE_CHECKOUT_EXPIRY_HOURS = float(os.environ.get("STRIPE_CHECKOUT_EXPIRY_HOURS", 24))
+ORDER_CONFIRMATION_URL = os.environ.get(
+    "ORDER_CONFIRMATION_URL", "https://yourwebsite.com/order-confirmation/{order_id}"
+)
+
+
+def configure_stripe(api_key: str, api_base=None, timeout=STRIPE_TIMEOUT, max_retries: int = STRIPE_MAX_RETRIES, session=None):
+    """
+    Configure the stripe module with an explicit timeout and a bounded number of
+    network retries. Retries are safe because every create call carries an
+    idempotency key. `api_base` points the client at a local stand-in, and
+    `session` lets requests go through a shared keep-alive transport session.
+    """
+    stripe.api_key = api_key
+    if api_base:
+        stripe.api_base = api_base
+    stripe.max_network_retries = max_retries
+    stripe.default_http_client = stripe.http_client.RequestsClient(timeout=timeout, session=session)
+
+
+class PaymentLinkService:
+    """Create Stripe Checkout payment links for orders against a cached Product per location."""
+
+    def __init__(self, product_id: str = STRIPE_PRODUCT_ID, currency: str = "usd",
+                 expiry_hours: float = STRIPE_CHECKOUT_EXPIRY_HOURS):
+        self.product_id = product_id
+        self.currency = currency
+        self.expiry_hours = expiry_hours
+        self._product_ids = set()
+        self._lock = threading.Lock()
+
+    def _get_product_id(self, tenant) -> str:
+        product_id = f"{self.product_id}-{tenant.tenant_id}"
+        if product_id in self._product_ids:
+            return product_id
+        with self._lock:
+            if product_id in self._product_ids:
+                return product_id
+            try:
+                stripe.Product.retrieve(product_id)
+            except stripe.error.InvalidRequestError:
+                logging.info(f"Creating Stripe Product {product_id}")
+                stripe.Product.create(
+                    id=product_id,
+                    name=f"{tenant.name} Order",
+                    metadata={"tenant_id": tenant.tenant_id},
+                    idempotency_key=f"product-{product_id}",
+                )
+            self._product_ids.add(product_id)
+            return product_id
+
+    def create_payment_link(self, order_id: int, customer_id: int, order_type: str, total_amount: float, tenant) -> str:
+        """Return the URL of a Checkout Session for the order's total amount at `tenant`'s location."""
+        product_id = self._get_product_id(tenant)
+        metadata = {
+            "tenant_id": tenant.tenant_id,
+            "order_id": str(order_id),
+            "customer_id": str(customer_id),
+            "order_type": order_type,
+        }
+        options = {}
+        if self.expiry_hours < 24:
+            # Left out at 24 h, Stripe's default, so clock skew can't push it past the maximum
+            options["expires_at"] = int(time.time() + self.expiry_hours * 3600)
+        session = stripe.checkout.Session.create(
+            mode="payment",
+            line_items=[{
+                "price_data": {
+                    "currency": self.currency,
+                    "product": product_id,
+                    "unit_amount": int(round(total_amount * 100)),  # Total in cents
+                },
+                "quantity": 1,
+            }],
+            success_url=ORDER_CONFIRMATION_URL.format(order_id=order_id),
+            payment_intent_data={
+                "description": f"Order #{order_id} - {tenant.name}",
+                "metadata": metadata,
+            },
+            metadata=metadata,
+            idempotency_key=f"{tenant.tenant_id}-order-{order_id}-checkout",
+            **options,
+        )
+        return session.url
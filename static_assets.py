@@ -0,0 +1,127 @@
+# Static serving for the React build
+#
+# The build output is precompressed once (gzip, and brotli when the brotli
+# package is installed) so requests only pick a file: the encoding is
+# negotiated from Accept-Encoding, content-hashed assets are cached as
+# immutable, and index.html is revalidated with its ETag. Files are handed to
+# the server with send_file through the WSGI file wrapper. Under gunicorn's
+# gevent worker that is a cooperative copy loop on a greenlet, so static
+# requests don't take threads away from /chat, but the bytes are still copied
+# through the process; for zero-copy sending put a front-end server such as
+# nginx in front and enable X-Sendfile (USE_X_SENDFILE).
+#
+# Precompress at build time with:
+#
+#   python static_assets.py build ./build
+
+import gzip
+import logging
+import mimetypes
+import os
+import re
+import sys
+
+from flask import Blueprint, abort, request, send_file
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+COMPRESSIBLE_EXTENSIONS = {".html", ".js", ".css", ".json", ".map", ".svg", ".txt", ".ico", ".webmanifest", ".xml"}
+MIN_COMPRESS_SIZE = 1024
+
+# CRA emits e.g. static/js/main.3f2a1b9c.js and static/media/logo.6ce24c58023cc2f8fd88fe9d219db6c6.svg
+HASHED_ASSET = re.compile(r"\.[0-9a-f]{8,}\.")
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+# Preferred first; suffix of the precompressed file
+ENCODINGS = [("br", ".br"), ("gzip", ".gz")]
+
+
+def _is_stale(source: str, compressed: str) -> bool:
+    return not os.path.exists(compressed) or os.path.getmtime(compressed) < os.path.getmtime(source)
+
+
+def precompress(build_dir: str) -> int:
+    """Write .gz (and .br) siblings for compressible files that lack an up-to-date one. Returns files written."""
+    written = 0
+    for dirpath, _, filenames in os.walk(build_dir):
+        for filename in filenames:
+            if os.path.splitext(filename)[1] not in COMPRESSIBLE_EXTENSIONS:
+                continue
+            source = os.path.join(dirpath, filename)
+            if os.path.getsize(source) < MIN_COMPRESS_SIZE:
+                continue
+            with open(source, "rb") as f:
+                data = None
+                if _is_stale(source, source + ".gz"):
+                    data = f.read()
+                    with open(source + ".gz", "wb") as out:
+                        out.write(gzip.compress(data, compresslevel=9, mtime=0))
+                    written += 1
+                if brotli is not None and _is_stale(source, source + ".br"):
+                    data = data if data is not None else f.read()
+                    with open(source + ".br", "wb") as out:
+                        out.write(brotli.compress(data, quality=11))
+                    written += 1
+    if brotli is None:
+        logging.info("brotli is not installed; serving gzip only")
+    return written
+
+
+def create_static_blueprint(build_dir: str) -> Blueprint:
+    """Blueprint serving the React build from `build_dir`."""
+    build_dir = os.path.abspath(build_dir)
+    static_assets = Blueprint("static_assets", __name__)
+
+    def serve(path: str):
+        full_path = safe_join(build_dir, path)
+        if full_path is None or not os.path.isfile(full_path):
+            abort(404)
+
+        # Highest q-value wins, ENCODINGS order breaks ties; q=0 means "not acceptable"
+        chosen, encoding, best = full_path, None, 0
+        for name, suffix in ENCODINGS:
+            quality = request.accept_encodings[name]
+            if quality > best and os.path.isfile(full_path + suffix):
+                chosen, encoding, best = full_path + suffix, name, quality
+
+        mimetype = mimetypes.guess_type(full_path)[0] or "application/octet-stream"
+        hashed = HASHED_ASSET.search(os.path.basename(path)) is not None
+        response = send_file(
+            chosen,
+            mimetype=mimetype,
+            download_name=os.path.basename(full_path),
+            conditional=True,
+            etag=True,
+            max_age=None,
+            last_modified=os.path.getmtime(full_path),
+        )
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+        if os.path.isfile(full_path + ".gz") or os.path.isfile(full_path + ".br"):
+            response.vary.add("Accept-Encoding")
+        response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL if hashed else REVALIDATE_CACHE_CONTROL
+        return response
+
+    # define a route for the default URL
+    @static_assets.route('/')
+    def serve_react():
+        return serve('index.html')
+
+    @static_assets.route('/<path:path>')
+    def serve_static(path):
+        return serve(path)
+
+    return static_assets
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3 or sys.argv[1] != 'build':
+        sys.exit("usage: python static_assets.py build <build dir>")
+    print(f"Precompressed {precompress(sys.argv[2])} files in {sys.argv[2]}")
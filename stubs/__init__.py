@@ -0,0 +1 @@
+# Local stand-ins for external providers, used by benchmarks and load tests
@@ -0,0 +1,97 @@
+# Shared plumbing for the local provider stand-ins
+
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import random
+import re
+import threading
+import time
+from urllib.parse import parse_qsl
+
+
+def decode_form(pairs) -> dict:
+    """Decode Stripe/Twilio style form pairs (`a[b][0]=c`) into nested dicts and lists."""
+    result = {}
+    for key, value in pairs:
+        parts = re.findall(r"[^\[\]]+", key)
+        node = result
+        for part, next_part in zip(parts, parts[1:]):
+            node = node.setdefault(part, {})
+        node[parts[-1]] = value
+    return _lists_from_indexes(result)
+
+
+def _lists_from_indexes(node):
+    if not isinstance(node, dict):
+        return node
+    if node and all(k.isdigit() for k in node):
+        return [_lists_from_indexes(node[k]) for k in sorted(node, key=int)]
+    return {k: _lists_from_indexes(v) for k, v in node.items()}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_body(self) -> bytes:
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def read_form(self) -> dict:
+        return decode_form(parse_qsl(self.read_body().decode(), keep_blank_values=True))
+
+    def send_json(self, payload, status: int = 200):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def simulate_provider(self) -> bool:
+        """
+        Apply the configured latency and error rate. Returns True if an injected
+        error has already been sent, in which case the handler should stop.
+        """
+        self.server.requests[f"{self.command} {self.path.split('?')[0]}"] += 1
+        latency = self.server.latency
+        if latency:
+            time.sleep(max(0.0, random.gauss(latency, latency * self.server.jitter)))
+        if self.server.error_rate and random.random() < self.server.error_rate:
+            self.read_body()
+            self.send_json({"error": {"type": "api_error", "message": "Injected failure"}}, 503)
+            return True
+        return False
+
+
+class StubServer(ThreadingHTTPServer):
+    """A threaded HTTP server with configurable per-request latency (seconds) and error rate."""
+
+    daemon_threads = True
+
+    def __init__(self, handler, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0,
+                 jitter: float = 0.1, error_rate: float = 0.0):
+        super().__init__((host, port), handler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.requests = Counter()
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
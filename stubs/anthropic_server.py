@@ -0,0 +1,159 @@
+# Local Anthropic Messages API stand-in
+#
+# Replays a scripted ordering conversation: each user message is matched to a
+# script turn, which answers with a fixed sequence of tool calls and then a
+# text reply. Arguments are filled in from the conversation itself (the name
+# and phone number the user gave, the customer and order IDs returned by
+# earlier tools), so many independent sessions can run against one server.
+# Point the app at it with ANTHROPIC_API_URL=http://127.0.0.1:<port>.
+#
+#   python -m stubs.anthropic_server --port 12113 --latency-ms 800
+
+import argparse
+import itertools
+import json
+import re
+
+from stubs._server import StubHandler, StubServer
+
+
+# (pattern matched against the user's message, tool calls, final reply)
+SCRIPT = [
+    (r"my phone is", [
+        ("check_customer_exists", {"phone": "{phone}"}),
+        ("create_or_update_customer", {"name": "{name}", "phone": "{phone}"}),
+    ], "Welcome, {name}! 😊 What would you like to order today?"),
+    (r"\bmenu\b", [
+        ("get_menu_categories", {}),
+        ("get_menu_items", {"category_id": "{category_id}"}),
+    ], "| Item | Price |\n|------|-------|\n| *Gnocchi* | $19.00 |\n\nWhat can I get for you? 🍝"),
+    (r"\badd item\b", [
+        ("add_to_cart", {"customer_id": "{customer_id}", "item_id": "{item_id}", "quantity": "{quantity}"}),
+        ("view_cart", {"customer_id": "{customer_id}"}),
+    ], "Added to your cart! 🛒 Would you like anything else?"),
+    (r"\bplace\b", [
+        ("place_order", {"customer_id": "{customer_id}", "order_type": "{order_type}"}),
+    ], "Your order is placed! ✅ A payment link has been sent to your phone. 📱💳"),
+    (r"\bstatus\b", [
+        ("get_order_status", {"order_id": "{order_id}"}),
+    ], "Your order is being prepared! 🕒"),
+    (r"", [], "Happy to help! 😊"),
+]
+
+# Values picked out of the conversation for argument templates
+EXTRACTORS = {
+    "name": r"I'm ([A-Za-z][\w ]*?)(?: and|,|\.|$)",
+    "phone": r"(\+1\d{10})",
+    "category_id": r"category (\d+)",
+    "item_id": r"item (\d+)",
+    "quantity": r"\bx(\d+)\b",
+    "order_type": r"\b(pickup|delivery)\b",
+    "customer_id": r"Customer ID: (\d+)",
+    "order_id": r"Order ID: (\d+)",
+}
+DEFAULTS = {"category_id": 1, "quantity": 1, "order_type": "pickup"}
+
+
+def _text(content) -> str:
+    if isinstance(content, str):
+        return content
+    parts = []
+    for block in content:
+        if block.get("type") == "text":
+            parts.append(block.get("text", ""))
+        elif block.get("type") == "tool_result":
+            parts.append(_text(block.get("content") or ""))
+    return "\n".join(parts)
+
+
+def _is_tool_result(message) -> bool:
+    content = message.get("content")
+    return isinstance(content, list) and any(block.get("type") == "tool_result" for block in content)
+
+
+def _fill(template, values):
+    if isinstance(template, str):
+        whole = re.fullmatch(r"\{(\w+)\}", template)
+        if whole:
+            value = values.get(whole.group(1))
+            return int(value) if isinstance(value, str) and value.isdigit() else value
+        return template.format(**{k: v for k, v in values.items() if v is not None})
+    return {key: _fill(value, values) for key, value in template.items()}
+
+
+def plan_response(messages) -> dict:
+    """Decide the next assistant content block for a conversation."""
+    # The latest real user message starts the current script turn; tool
+    # results after it tell us how far into the turn we are.
+    start = max(i for i, m in enumerate(messages) if m["role"] == "user" and not _is_tool_result(m))
+    user_text = _text(messages[start]["content"])
+    tool_results = sum(1 for m in messages[start + 1:] if m["role"] == "user" and _is_tool_result(m))
+
+    history = "\n".join(_text(m["content"]) for m in messages)
+    values = dict(DEFAULTS)
+    for name, pattern in EXTRACTORS.items():
+        # Later mentions win (e.g. the most recent order ID).
+        found = re.findall(pattern, user_text if name in ("item_id", "quantity", "order_type", "category_id") else history)
+        if found:
+            values[name] = found[-1]
+
+    for pattern, tools, reply in SCRIPT:
+        if re.search(pattern, user_text, re.IGNORECASE):
+            break
+    if tool_results < len(tools):
+        name, arguments = tools[tool_results]
+        return {"type": "tool_use", "name": name, "input": _fill(arguments, values)}
+    return {"type": "text", "text": _fill(reply, values)}
+
+
+class AnthropicHandler(StubHandler):
+
+    def do_POST(self):
+        if self.simulate_provider():
+            return
+        if self.path.split("?")[0] != "/v1/messages":
+            return self.send_json({"type": "error", "error": {"type": "not_found_error", "message": "Not found"}}, 404)
+        request = json.loads(self.read_body() or b"{}")
+        block = plan_response(request.get("messages", []))
+        message_id = next(self.server.ids)
+        if block["type"] == "tool_use":
+            block["id"] = f"toolu_{message_id:020d}"
+            stop_reason = "tool_use"
+        else:
+            stop_reason = "end_turn"
+        prompt_chars = len(json.dumps(request.get("messages", []))) + len(json.dumps(request.get("system", "")))
+        self.send_json({
+            "id": f"msg_{message_id:020d}",
+            "type": "message",
+            "role": "assistant",
+            "model": request.get("model"),
+            "content": [block],
+            "stop_reason": stop_reason,
+            "stop_sequence": None,
+            "usage": {"input_tokens": prompt_chars // 4, "output_tokens": len(json.dumps(block)) // 4},
+        })
+
+
+class AnthropicStub(StubServer):
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0,
+                 jitter: float = 0.1, error_rate: float = 0.0):
+        super().__init__(AnthropicHandler, host, port, latency, jitter, error_rate)
+        self.ids = itertools.count(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local Anthropic Messages API stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=12113)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = AnthropicStub(args.host, args.port, latency=args.latency_ms / 1000, error_rate=args.error_rate)
+    print(f"Anthropic stand-in listening on {server.base_url}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+# Local Stripe stand-in
+#
+# Implements just enough of the Stripe API for the order flow: Products,
+# Prices (including lookup keys), Payment Links and Checkout Sessions, with
+# idempotency-key replay. Point the app at it with STRIPE_API_BASE=http://127.0.0.1:<port>.
+#
+#   python -m stubs.stripe_server --port 12111 --latency-ms 150
+
+import argparse
+import itertools
+import threading
+import time
+from urllib.parse import parse_qsl, urlsplit
+
+from stubs._server import StubHandler, StubServer, decode_form
+
+
+class StripeHandler(StubHandler):
+
+    def do_GET(self):
+        if self.simulate_provider():
+            return
+        url = urlsplit(self.path)
+        parts = url.path.strip("/").split("/")
+        if parts[:2] == ["v1", "products"] and len(parts) == 3:
+            product = self.server.products.get(parts[2])
+            if product is None:
+                return self.send_error_json(404, "resource_missing", f"No such product: '{parts[2]}'")
+            return self.send_json(product)
+        if url.path == "/v1/prices":
+            query = decode_form(parse_qsl(url.query))
+            lookup_keys = set(query.get("lookup_keys", []))
+            data = [p for p in self.server.prices.values() if p["lookup_key"] in lookup_keys]
+            return self.send_json({"object": "list", "url": "/v1/prices", "has_more": False, "data": data})
+        self.send_error_json(404, "resource_missing", f"Unrecognized request URL (GET: {url.path})")
+
+    def do_POST(self):
+        if self.simulate_provider():
+            return
+        params = self.read_form()
+        key = self.headers.get("Idempotency-Key")
+        with self.server.lock:
+            if key and (self.path, key) in self.server.idempotent:
+                return self.send_json(self.server.idempotent[(self.path, key)])
+            if self.path == "/v1/products":
+                result = self.create_product(params)
+            elif self.path == "/v1/prices":
+                result = self.create_price(params)
+            elif self.path == "/v1/payment_links":
+                result = self.create_payment_link(params)
+            elif self.path == "/v1/checkout/sessions":
+                result = self.create_checkout_session(params)
+            else:
+                return self.send_error_json(404, "resource_missing", f"Unrecognized request URL (POST: {self.path})")
+            if isinstance(result, tuple):
+                return self.send_error_json(*result)
+            if key:
+                self.server.idempotent[(self.path, key)] = result
+        self.send_json(result)
+
+    def send_error_json(self, status, code, message):
+        self.send_json({"error": {"type": "invalid_request_error", "code": code, "message": message}}, status)
+
+    def _id(self, prefix):
+        return f"{prefix}_{next(self.server.ids):08d}"
+
+    def create_product(self, params):
+        product_id = params.get("id") or self._id("prod")
+        if product_id in self.server.products:
+            return (400, "resource_already_exists", "Product already exists.")
+        product = {"id": product_id, "object": "product", "name": params.get("name"), "created": int(time.time())}
+        self.server.products[product_id] = product
+        return product
+
+    def create_price(self, params):
+        product_id = params.get("product")
+        if "product_data" in params:
+            product_id = self.create_product(params["product_data"])["id"]
+        if product_id not in self.server.products:
+            return (400, "resource_missing", f"No such product: '{product_id}'")
+        lookup_key = params.get("lookup_key")
+        if lookup_key:
+            for price in self.server.prices.values():
+                if price["lookup_key"] == lookup_key:
+                    if params.get("transfer_lookup_key") != "true":
+                        return (400, "lookup_key_exists", "A price with this lookup_key already exists.")
+                    price["lookup_key"] = None
+        price = {
+            "id": self._id("price"),
+            "object": "price",
+            "product": product_id,
+            "unit_amount": int(params["unit_amount"]),
+            "currency": params.get("currency", "usd"),
+            "lookup_key": lookup_key,
+            "active": True,
+        }
+        self.server.prices[price["id"]] = price
+        return price
+
+    def create_payment_link(self, params):
+        for item in params.get("line_items", []):
+            if item.get("price") not in self.server.prices:
+                return (400, "resource_missing", f"No such price: '{item.get('price')}'")
+        link_id = self._id("plink")
+        link = {
+            "id": link_id,
+            "object": "payment_link",
+            "url": f"{self.server.base_url}/pay/{link_id}",
+            "metadata": params.get("metadata", {}),
+            "active": True,
+        }
+        self.server.payment_links[link_id] = link
+        return link
+
+    def create_checkout_session(self, params):
+        amount_total = 0
+        for item in params.get("line_items", []):
+            price_data = item.get("price_data")
+            if price_data is None:
+                price = self.server.prices.get(item.get("price"))
+                if price is None:
+                    return (400, "resource_missing", f"No such price: '{item.get('price')}'")
+                unit_amount = price["unit_amount"]
+            elif price_data.get("product") not in self.server.products:
+                return (400, "resource_missing", f"No such product: '{price_data.get('product')}'")
+            else:
+                unit_amount = int(price_data["unit_amount"])
+            amount_total += unit_amount * int(item.get("quantity", 1))
+        session_id = self._id("cs_test")
+        session = {
+            "id": session_id,
+            "object": "checkout.session",
+            "url": f"{self.server.base_url}/pay/{session_id}",
+            "amount_total": amount_total,
+            "metadata": params.get("metadata", {}),
+            "status": "open",
+        }
+        self.server.checkout_sessions[session_id] = session
+        return session
+
+
+class StripeStub(StubServer):
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0,
+                 jitter: float = 0.1, error_rate: float = 0.0):
+        super().__init__(StripeHandler, host, port, latency, jitter, error_rate)
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.products = {}
+        self.prices = {}
+        self.payment_links = {}
+        self.checkout_sessions = {}
+        self.idempotent = {}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local Stripe stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=12111)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = StripeStub(args.host, args.port, latency=args.latency_ms / 1000, error_rate=args.error_rate)
+    print(f"Stripe stand-in listening on {server.base_url}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+# Local Twilio stand-in
+#
+# Accepts Messages.create calls and records them instead of sending SMS.
+# Point the app at it with TWILIO_API_BASE=http://127.0.0.1:<port>.
+#
+#   python -m stubs.twilio_server --port 12112 --latency-ms 200
+
+import argparse
+import itertools
+import re
+import threading
+
+from stubs._server import StubHandler, StubServer
+
+
+MESSAGES_PATH = re.compile(r"^/2010-04-01/Accounts/(?P<account>[^/]+)/Messages\.json$")
+
+
+class TwilioHandler(StubHandler):
+
+    def do_POST(self):
+        if self.simulate_provider():
+            return
+        match = MESSAGES_PATH.match(self.path.split("?")[0])
+        if not match:
+            return self.send_json({"code": 20404, "message": "The requested resource was not found", "status": 404}, 404)
+        params = self.read_form()
+        with self.server.lock:
+            message = {
+                "sid": f"SM{next(self.server.ids):032d}",
+                "account_sid": match.group("account"),
+                "to": params.get("To"),
+                "from": params.get("From"),
+                "body": params.get("Body"),
+                "status": "queued",
+                "num_segments": "1",
+                "direction": "outbound-api",
+            }
+            self.server.messages.append(message)
+        self.send_json(message, 201)
+
+
+class TwilioStub(StubServer):
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0,
+                 jitter: float = 0.1, error_rate: float = 0.0):
+        super().__init__(TwilioHandler, host, port, latency, jitter, error_rate)
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.messages = []
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local Twilio stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=12112)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = TwilioStub(args.host, args.port, latency=args.latency_ms / 1000, error_rate=args.error_rate)
+    print(f"Twilio stand-in listening on {server.base_url}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
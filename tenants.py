@@ -0,0 +1,321 @@
+# Multi-location tenancy
+#
+# Each restaurant location is a tenant with its own menu/order database,
+# contact numbers and prompt details. The tenant for a request is resolved by
+# the app and stored in `current_tenant`; database access, SMS and the
+# assistant prompt all read it from there. Per-tenant resources (a small
+# SQLite connection pool, the order status feed and cached catalog data) are
+# kept in an LRU, so one process can serve many locations without holding
+# connections open for the ones that have gone quiet.
+#
+# Extra locations are configured in a JSON file named by TENANTS_FILE:
+#
+#   {
+#     "oakland": {
+#       "name": "Bottega Oakland",
+#       "db_name": "bottega_oakland.db",
+#       "twilio_phone_number": "+15105550100",
+#       "restaurant_phone_number": "+15105550101",
+#       "address": "500 Grand Ave, Oakland, CA 94610, United States",
+#       "cancellation_phone_number": "+15105550101"
+#     }
+#   }
+#
+# Fields left out are inherited from the default location.
+#
+# Cached catalog (menu) data is dropped as soon as a menu table changes:
+# triggers bump CatalogVersion on every write to them, and the cache checks
+# that version at most every `catalog_check_interval` seconds. The TTL is
+# only a backstop.
+
+from collections import OrderedDict
+from contextvars import ContextVar
+import json
+import logging
+import queue
+import sqlite3
+import threading
+import time
+
+from order_status import OrderStatusFeed, ensure_order_status_schema
+
+
+class UnknownTenant(KeyError):
+    """Raised for a tenant ID that isn't configured."""
+
+
+class Tenant:
+    """One restaurant location."""
+
+    FIELDS = ("name", "db_name", "twilio_phone_number", "restaurant_phone_number", "address", "cancellation_phone_number")
+
+    def __init__(self, tenant_id: str, name: str, db_name: str, twilio_phone_number: str,
+                 restaurant_phone_number: str, address: str, cancellation_phone_number: str):
+        self.tenant_id = tenant_id
+        self.name = name
+        self.db_name = db_name
+        self.twilio_phone_number = twilio_phone_number
+        self.restaurant_phone_number = restaurant_phone_number
+        self.address = address
+        self.cancellation_phone_number = cancellation_phone_number
+
+    def prompt_vars(self) -> dict:
+        """Variables filled into the assistant prompt for this location."""
+        return {
+            "restaurant_name": self.name,
+            "restaurant_address": self.address,
+            "cancellation_phone": self.cancellation_phone_number,
+        }
+
+    def __repr__(self):
+        return f"Tenant({self.tenant_id!r})"
+
+
+def lookup_tenant(tenants: dict, tenant_id: str) -> Tenant:
+    try:
+        return tenants[tenant_id]
+    except KeyError:
+        raise UnknownTenant(tenant_id) from None
+
+
+def load_tenants(default: Tenant, path=None) -> dict:
+    """The default tenant plus any configured in the JSON file at `path`."""
+    tenants = {default.tenant_id: default}
+    if path:
+        with open(path) as f:
+            config = json.load(f)
+        for tenant_id, fields in config.items():
+            values = {field: fields.get(field, getattr(default, field)) for field in Tenant.FIELDS}
+            if "db_name" not in fields:
+                raise ValueError(f"Tenant {tenant_id!r} in {path} has no db_name")
+            tenants[tenant_id] = Tenant(tenant_id, **values)
+    return tenants
+
+
+CATALOG_TABLES = ("MenuCategories", "MenuItems", "MenuConfigurations", "MenuAddOns")
+
+
+def ensure_catalog_version_schema(db_path: str) -> None:
+    """Add the CatalogVersion counter and the triggers that bump it on menu changes. Safe to run on every start."""
+    conn = sqlite3.connect(db_path)
+    try:
+        with conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS CatalogVersion (Version INTEGER NOT NULL)")
+            if conn.execute("SELECT COUNT(*) FROM CatalogVersion").fetchone()[0] == 0:
+                conn.execute("INSERT INTO CatalogVersion (Version) VALUES (0)")
+            for table in CATALOG_TABLES:
+                for operation in ("INSERT", "UPDATE", "DELETE"):
+                    conn.execute(f"""
+                        CREATE TRIGGER IF NOT EXISTS trg_{table.lower()}_{operation.lower()}_catalog_version
+                        AFTER {operation} ON {table}
+                        BEGIN
+                            UPDATE CatalogVersion SET Version = Version + 1;
+                        END
+                    """)
+    finally:
+        conn.close()
+
+
+# Tenant of the request being handled
+current_tenant: ContextVar[Tenant] = ContextVar("current_tenant")
+
+
+class PooledConnection:
+    """
+    Context manager over a pooled connection with the same semantics as using
+    a sqlite3 connection in a `with` block (commit on success, rollback on
+    error), returning the connection to its pool afterwards.
+    """
+
+    def __init__(self, pool, conn):
+        self.pool = pool
+        self.conn = conn
+
+    def __enter__(self):
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                self.conn.commit()
+            else:
+                self.conn.rollback()
+        finally:
+            self.pool.release(self.conn)
+        return False
+
+
+class ConnectionPool:
+    """Reuses up to `max_idle` SQLite connections to one database across threads."""
+
+    def __init__(self, connect, max_idle: int = 8):
+        self.connect = connect
+        self._idle = queue.LifoQueue(maxsize=max_idle)
+        self._closed = False
+        self.opened = 0
+
+    def connection(self) -> PooledConnection:
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = self.connect()
+            self.opened += 1
+        return PooledConnection(self, conn)
+
+    def release(self, conn):
+        if self._closed:
+            conn.close()
+            return
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+    def stats(self) -> dict:
+        return {"idle": self._idle.qsize(), "opened": self.opened}
+
+
+class TenantResources:
+    """Connection pool, order status feed and catalog cache for one tenant."""
+
+    def __init__(self, tenant: Tenant, connect, catalog_ttl: float = 300.0, max_idle_connections: int = 8,
+                 catalog_check_interval: float = 1.0):
+        self.tenant = tenant
+        ensure_order_status_schema(tenant.db_name)
+        ensure_catalog_version_schema(tenant.db_name)
+        self.pool = ConnectionPool(lambda: connect(tenant.db_name), max_idle_connections)
+        self.feed = OrderStatusFeed(tenant.db_name)
+        self.feed.start()
+        self.catalog_ttl = catalog_ttl
+        self.catalog_check_interval = catalog_check_interval
+        self._catalog = {}
+        self._catalog_lock = threading.Lock()
+        self._catalog_version = None
+        self._catalog_checked = 0.0
+        self.catalog_invalidations = 0
+
+    def _query_catalog_version(self) -> int:
+        with self.pool.connection() as conn:
+            return conn.execute("SELECT Version FROM CatalogVersion").fetchone()[0]
+
+    def _check_catalog_version(self, now: float):
+        with self._catalog_lock:
+            if now - self._catalog_checked < self.catalog_check_interval:
+                return
+            self._catalog_checked = now
+        version = self._query_catalog_version()
+        with self._catalog_lock:
+            if version != self._catalog_version:
+                if self._catalog_version is not None:
+                    logging.info(f"Menu changed for tenant {self.tenant.tenant_id}; dropping cached catalog")
+                self._catalog_version = version
+                self._drop_catalog()
+
+    def catalog(self, key, loader):
+        """
+        Cached menu data for this tenant. `loader` is called (outside the lock)
+        when the entry is missing, the menu has changed since it was loaded,
+        or it is older than `catalog_ttl` seconds.
+        """
+        now = time.monotonic()
+        self._check_catalog_version(now)
+        with self._catalog_lock:
+            entry = self._catalog.get(key)
+            if entry and now - entry[0] < self.catalog_ttl:
+                return entry[1]
+            version = self._catalog_version
+        value = loader()
+        with self._catalog_lock:
+            # Don't keep data loaded before a change that was noticed meanwhile
+            if version == self._catalog_version:
+                self._catalog[key] = (now, value)
+        return value
+
+    def invalidate_catalog(self):
+        with self._catalog_lock:
+            self._drop_catalog()
+
+    def _drop_catalog(self):
+        # With _catalog_lock held
+        if self._catalog:
+            self.catalog_invalidations += 1
+        self._catalog.clear()
+
+    def close(self):
+        self.feed.stop()
+        self.pool.close()
+
+    def stats(self) -> dict:
+        return {
+            "connections": self.pool.stats(),
+            "catalog_entries": len(self._catalog),
+            "catalog_version": self._catalog_version,
+            "catalog_invalidations": self.catalog_invalidations,
+            "order_status_feed": self.feed.stats(),
+        }
+
+
+class TenantCache:
+    """LRU of TenantResources; the least recently used tenant is closed once `max_tenants` is exceeded."""
+
+    def __init__(self, connect, max_tenants: int = 32, catalog_ttl: float = 300.0):
+        self.connect = connect
+        self.max_tenants = max_tenants
+        self.catalog_ttl = catalog_ttl
+        self._resources = OrderedDict()
+        self._building = {}
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, tenant: Tenant) -> TenantResources:
+        while True:
+            with self._lock:
+                resources = self._resources.get(tenant.tenant_id)
+                if resources is not None:
+                    self._resources.move_to_end(tenant.tenant_id)
+                    return resources
+                building = self._building.get(tenant.tenant_id)
+                if building is None:
+                    building = self._building[tenant.tenant_id] = threading.Event()
+                    break
+            # Another thread is opening this tenant; wait for it rather than
+            # holding the lock that every other tenant's requests need.
+            building.wait()
+
+        # Opening a tenant can migrate its database, so it happens outside the lock
+        resources = None
+        try:
+            resources = TenantResources(tenant, self.connect, self.catalog_ttl)
+        finally:
+            evicted = []
+            with self._lock:
+                del self._building[tenant.tenant_id]
+                if resources is not None:
+                    self._resources[tenant.tenant_id] = resources
+                    while len(self._resources) > self.max_tenants:
+                        evicted.append(self._resources.popitem(last=False)[1])
+                        self.evictions += 1
+            # Waiters find the resources, or (if opening failed) try again themselves
+            building.set()
+        for old in evicted:
+            logging.info(f"Evicting cached resources for tenant {old.tenant.tenant_id}")
+            old.close()
+        return resources
+
+    def stats(self) -> dict:
+        with self._lock:
+            resources = dict(self._resources)
+        return {
+            "cached_tenants": len(resources),
+            "max_tenants": self.max_tenants,
+            "evictions": self.evictions,
+            "tenants": {tenant_id: r.stats() for tenant_id, r in resources.items()},
+        }
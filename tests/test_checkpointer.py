@@ -0,0 +1,168 @@
+# Crash-recovery and write-behind behaviour of WriteBehindSaver
+#
+# A "restart" is a fresh SqliteSaver/WriteBehindSaver on the same database
+# file: whatever was only in the old saver's memory is gone, as after a crash.
+#
+#   python -m pytest tests
+
+import sqlite3
+import time
+from typing import Annotated
+
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langgraph.checkpoint.sqlite import SqliteSaver
+from langgraph.graph import END, StateGraph
+from langgraph.graph.message import AnyMessage, add_messages
+import pytest
+from typing_extensions import TypedDict
+
+from checkpointer import WriteBehindSaver, wrote_tool_results
+
+
+class State(TypedDict):
+    messages: Annotated[list[AnyMessage], add_messages]
+
+
+class Crash(Exception):
+    pass
+
+
+def build_graph(checkpointer, tool_name="get_menu_items", crash_after_tool=False):
+    """assistant -> tools -> assistant per turn, like the app's graph."""
+
+    def assistant(state: State):
+        last = state["messages"][-1]
+        if isinstance(last, HumanMessage):
+            call = {"name": tool_name, "args": {}, "id": f"call_{len(state['messages'])}"}
+            return {"messages": AIMessage(content="", tool_calls=[call])}
+        if crash_after_tool:
+            raise Crash()
+        return {"messages": AIMessage(content=f"Done with {last.name}")}
+
+    def tools(state: State):
+        call = state["messages"][-1].tool_calls[0]
+        return {"messages": [ToolMessage(content="ok", tool_call_id=call["id"], name=call["name"])]}
+
+    builder = StateGraph(State)
+    builder.add_node("assistant", assistant)
+    builder.add_node("tools", tools)
+    builder.set_entry_point("assistant")
+    builder.add_conditional_edges("assistant", lambda state: "tools" if state["messages"][-1].tool_calls else END)
+    builder.add_edge("tools", "assistant")
+    return builder.compile(checkpointer=checkpointer)
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "checkpoints.db")
+
+
+def open_saver(db_path, **kwargs):
+    kwargs.setdefault("flush_interval", 0)
+    return WriteBehindSaver(SqliteSaver(sqlite3.connect(db_path, check_same_thread=False)), **kwargs)
+
+
+def config(thread_id="t1"):
+    return {"configurable": {"thread_id": thread_id}}
+
+
+def turn(graph, text, thread_id="t1"):
+    graph.invoke({"messages": [("user", text)]}, config(thread_id))
+
+
+def stored_rows(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute("SELECT thread_id, thread_ts, parent_ts FROM checkpoints ORDER BY thread_ts").fetchall()
+    finally:
+        conn.close()
+
+
+def test_restart_resumes_from_last_flushed_turn(db_path):
+    saver = open_saver(db_path)
+    graph = build_graph(saver)
+    turn(graph, "first")
+    saver.flush("t1")
+    turn(graph, "second")  # Answered in memory but never flushed: lost in the "crash"
+
+    restarted = build_graph(open_saver(db_path))
+    messages = restarted.get_state(config()).values["messages"]
+    assert [m.content for m in messages if isinstance(m, HumanMessage)] == ["first"]
+    assert messages[-1].content == "Done with get_menu_items"
+
+    turn(restarted, "third")
+    messages = restarted.get_state(config()).values["messages"]
+    assert [m.content for m in messages if isinstance(m, HumanMessage)] == ["first", "third"]
+
+
+def test_history_is_one_checkpoint_per_flush_chained_by_parent_ts(db_path):
+    saver = open_saver(db_path)
+    graph = build_graph(saver)
+    for text in ("one", "two", "three"):
+        turn(graph, text)
+        saver.flush("t1")
+
+    rows = stored_rows(db_path)
+    assert len(rows) == 3
+    assert rows[0][2] is None
+    assert [parent_ts for _, _, parent_ts in rows[1:]] == [ts for _, ts, _ in rows[:-1]]
+
+    history = list(open_saver(db_path).list(config()))
+    assert [c.config["configurable"]["thread_ts"] for c in history] == [ts for _, ts, _ in reversed(rows)]
+    assert history[0].parent_config["configurable"]["thread_ts"] == rows[1][1]
+
+
+def test_side_effecting_tool_step_is_flushed_before_the_turn_ends(db_path):
+    saver = open_saver(db_path, flush_after=wrote_tool_results({"place_order"}))
+    graph = build_graph(saver, tool_name="place_order", crash_after_tool=True)
+    with pytest.raises(Crash):
+        turn(graph, "place my order")
+
+    messages = build_graph(open_saver(db_path)).get_state(config()).values["messages"]
+    assert isinstance(messages[-1], ToolMessage)
+    assert messages[-1].name == "place_order"
+
+
+def test_other_tool_steps_are_not_flushed_early(db_path):
+    saver = open_saver(db_path, flush_after=wrote_tool_results({"place_order"}))
+    graph = build_graph(saver, crash_after_tool=True)
+    with pytest.raises(Crash):
+        turn(graph, "show me the menu")
+
+    assert stored_rows(db_path) == []
+
+
+def test_dirty_threads_are_never_evicted(db_path):
+    saver = open_saver(db_path, max_threads=1)
+    graph = build_graph(saver)
+    for thread_id in ("a", "b", "c"):
+        turn(graph, "hi", thread_id)
+
+    assert saver.stats()["hot_threads"] == 3
+    assert saver.stats()["dirty_threads"] == 3
+    assert saver.stats()["evictions"] == 0
+
+    # Once written, they can go: the next new thread brings the LRU back to max_threads
+    saver.flush()
+    turn(graph, "hi", "d")
+    assert saver.stats()["hot_threads"] == 1
+    assert saver.stats()["evictions"] == 3
+    saver.flush()
+
+    # Nothing unflushed was lost along the way
+    restarted = open_saver(db_path)
+    for thread_id in ("a", "b", "c", "d"):
+        assert restarted.get_tuple(config(thread_id)) is not None
+
+
+def test_interval_flusher_writes_pending_threads(db_path):
+    saver = open_saver(db_path, flush_interval=0.05).start()
+    try:
+        turn(build_graph(saver), "hi")
+        deadline = time.monotonic() + 5
+        while not stored_rows(db_path) and time.monotonic() < deadline:
+            time.sleep(0.02)
+        assert len(stored_rows(db_path)) == 1
+        assert saver.stats()["dirty_threads"] == 0
+    finally:
+        saver.stop()
@@ -0,0 +1,112 @@
+# Wait and catch-up behaviour of OrderStatusFeed
+#
+#   python -m pytest tests
+
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from order_status import (
+    OrderStatusFeed, append_order_status, check_status_token, ensure_order_status_schema, kitchen_status_subject,
+    order_status_subject, sign_status_token,
+)
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "orders.db")
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE Orders (
+            OrderID INTEGER PRIMARY KEY AUTOINCREMENT,
+            UpdatedAt DATETIME DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE TABLE OrderStatus (
+            StatusID INTEGER PRIMARY KEY AUTOINCREMENT,
+            OrderID INTEGER,
+            Status TEXT,
+            UpdatedAt DATETIME DEFAULT CURRENT_TIMESTAMP
+        );
+        INSERT INTO Orders (OrderID) VALUES (1), (2);
+    """)
+    conn.close()
+    ensure_order_status_schema(path)
+    return path
+
+
+def add_status(db_path, order_id, status):
+    conn = sqlite3.connect(db_path)
+    try:
+        with conn:
+            return append_order_status(conn.cursor(), order_id, status)
+    finally:
+        conn.close()
+
+
+@pytest.fixture
+def feed(db_path):
+    for status in ("Pending", "Preparing", "Ready"):
+        add_status(db_path, 1, status)
+    add_status(db_path, 2, "Pending")
+    # Started after the orders above, so none of them are in the ring buffer
+    feed = OrderStatusFeed(db_path, poll_interval=0.05)
+    feed.start()
+    yield feed
+    feed.stop()
+
+
+def count_subscriber_queries(feed, monkeypatch):
+    # The watcher's own polls (no order_id) aren't counted
+    calls = []
+    query_since = feed._query_since
+
+    def counting(*args, **kwargs):
+        if len(args) > 1:
+            calls.append(args)
+        return query_since(*args, **kwargs)
+
+    monkeypatch.setattr(feed, "_query_since", counting)
+    return calls
+
+
+def test_history_older_than_the_buffer_comes_from_the_log(feed):
+    events = feed.wait_for_events(0, order_id=1, timeout=1)
+    assert [event["status"] for event in events] == ["Pending", "Preparing", "Ready"]
+
+
+def test_caught_up_subscriber_blocks_instead_of_requerying(feed, monkeypatch):
+    calls = count_subscriber_queries(feed, monkeypatch)
+    # Order 1's history is all below the newest event (order 2's), and none of it
+    # is buffered: nothing new for this subscriber, so it waits out the timeout.
+    since = feed.wait_for_events(0, order_id=1, timeout=1)[-1]["id"]
+    started = time.monotonic()
+    assert feed.wait_for_events(since, order_id=1, timeout=0.3) == []
+    assert time.monotonic() - started >= 0.3
+    assert len(calls) == 2
+
+
+def test_caught_up_subscriber_is_woken_by_a_new_status(feed, db_path):
+    since = feed.wait_for_events(0, order_id=1, timeout=1)[-1]["id"]
+    threading.Timer(0.1, lambda: (add_status(db_path, 1, "Picked up"), feed.notify())).start()
+    started = time.monotonic()
+    events = feed.wait_for_events(since, order_id=1, timeout=5)
+    assert [event["status"] for event in events] == ["Picked up"]
+    assert time.monotonic() - started < 2
+
+
+def test_status_tokens_are_bound_to_their_subject():
+    token = sign_status_token("secret", order_status_subject("default", 7))
+    assert check_status_token("secret", order_status_subject("default", 7), token)
+    assert not check_status_token("secret", order_status_subject("default", 8), token)
+    assert not check_status_token("secret", order_status_subject("downtown", 7), token)
+    assert not check_status_token("other", order_status_subject("default", 7), token)
+    assert not check_status_token("", order_status_subject("default", 7), token)
+    assert not check_status_token("secret", order_status_subject("default", 7), "0.forged")
+
+
+def test_kitchen_stream_tokens_expire():
+    subject = kitchen_status_subject("default")
+    assert check_status_token("secret", subject, sign_status_token("secret", subject, int(time.time()) + 60))
+    assert not check_status_token("secret", subject, sign_status_token("secret", subject, int(time.time()) - 1))
@@ -0,0 +1,275 @@
+# Shared HTTP transport for external providers (Anthropic, Stripe, Twilio)
+#
+# Each provider gets a pooled keep-alive requests session with explicit
+# connect/read timeouts, a cap on concurrent in-flight calls and a circuit
+# breaker. When a provider is degraded its calls fail fast with
+# ProviderUnavailable instead of tying up every request thread waiting on it.
+#
+# Settings can be overridden per provider through the environment, e.g.
+# STRIPE_CONNECT_TIMEOUT, STRIPE_READ_TIMEOUT, STRIPE_MAX_CONCURRENCY,
+# STRIPE_BREAKER_THRESHOLD, STRIPE_BREAKER_RESET. TWILIO_API_BASE redirects
+# Twilio calls (e.g. to a local stand-in).
+
+from contextlib import contextmanager
+import logging
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class ProviderUnavailable(RuntimeError):
+    """Raised instead of calling a provider that is degraded or saturated."""
+
+    def __init__(self, provider: str, reason: str, retry_after: float = 0.0):
+        self.provider = provider
+        self.reason = reason
+        self.retry_after = retry_after
+        super().__init__(f"{provider} is temporarily unavailable: {reason}")
+
+
+class CallOutcome:
+    """Outcome of a guarded provider call."""
+
+    def __init__(self):
+        self.failed = False
+
+    def fail(self):
+        self.failed = True
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker.
+
+    closed: calls go through; `failure_threshold` consecutive failures open it.
+    open: calls fail fast until `reset_timeout` seconds have passed.
+    half_open: a single trial call is let through; success closes the circuit,
+    failure opens it again.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_call(self, provider: str):
+        with self._lock:
+            if self.state == "closed":
+                return
+            remaining = self.opened_at + self.reset_timeout - time.monotonic()
+            if self.state == "open" and remaining <= 0:
+                self.state = "half_open"
+            if self.state == "half_open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return
+            raise ProviderUnavailable(
+                provider,
+                f"circuit open after {self.consecutive_failures} consecutive failures",
+                retry_after=max(remaining, 1.0),
+            )
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.consecutive_failures = 0
+            self._trial_in_flight = False
+
+    def release_trial(self):
+        """Give back a half-open trial slot for a call that never reached the provider."""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            self._trial_in_flight = False
+            if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+                if self.state != "open":
+                    self.times_opened += 1
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+    def snapshot(self) -> dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "times_opened": self.times_opened,
+        }
+
+
+class ProviderTransport:
+    """Timeouts, concurrency limit and circuit breaker for one provider."""
+
+    def __init__(self, name: str, connect_timeout: float = 3.05, read_timeout: float = 10.0,
+                 max_concurrency: int = 16, acquire_timeout: float = 1.0,
+                 breaker_threshold: int = 5, breaker_reset: float = 30.0,
+                 origin=None, base_url=None):
+        self.name = name
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_concurrency = max_concurrency
+        self.acquire_timeout = acquire_timeout
+        self.origin = origin
+        self.base_url = base_url.rstrip("/") if base_url else None
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_reset)
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.calls = 0
+        self.failures = 0
+        self.rejected = 0
+        self._sessions = []
+
+    @classmethod
+    def from_env(cls, name: str, **defaults) -> "ProviderTransport":
+        prefix = name.upper()
+        env = os.environ.get
+        return cls(
+            name,
+            connect_timeout=float(env(f"{prefix}_CONNECT_TIMEOUT", defaults.get("connect_timeout", 3.05))),
+            read_timeout=float(env(f"{prefix}_READ_TIMEOUT", defaults.get("read_timeout", 10.0))),
+            max_concurrency=int(env(f"{prefix}_MAX_CONCURRENCY", defaults.get("max_concurrency", 16))),
+            acquire_timeout=float(env(f"{prefix}_ACQUIRE_TIMEOUT", defaults.get("acquire_timeout", 1.0))),
+            breaker_threshold=int(env(f"{prefix}_BREAKER_THRESHOLD", defaults.get("breaker_threshold", 5))),
+            breaker_reset=float(env(f"{prefix}_BREAKER_RESET", defaults.get("breaker_reset", 30.0))),
+            origin=defaults.get("origin"),
+            base_url=env(f"{prefix}_API_BASE"),
+        )
+
+    @property
+    def timeout(self) -> tuple:
+        return (self.connect_timeout, self.read_timeout)
+
+    @contextmanager
+    def guard(self, is_failure=None):
+        """
+        Run one provider call under the circuit breaker and concurrency limit.
+        Exceptions raised inside the block count as provider failures unless
+        `is_failure(exc)` says otherwise: False for an error the provider
+        answered with (e.g. a 400), which shows it is up, and None for one that
+        says nothing about the provider (e.g. a local error before the call).
+        Call `fail()` on the yielded outcome for failures that come back as responses.
+        """
+        self.breaker.before_call(self.name)
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            self.breaker.release_trial()
+            with self._lock:
+                self.rejected += 1
+            raise ProviderUnavailable(self.name, f"all {self.max_concurrency} connections busy", retry_after=1.0)
+        with self._lock:
+            self.in_flight += 1
+            self.calls += 1
+        outcome = CallOutcome()
+        no_verdict = False
+        try:
+            yield outcome
+        except Exception as e:
+            verdict = True if is_failure is None else is_failure(e)
+            if verdict:
+                outcome.fail()
+            no_verdict = verdict is None
+            raise
+        finally:
+            if outcome.failed:
+                with self._lock:
+                    self.failures += 1
+                self.breaker.record_failure()
+            elif no_verdict:
+                self.breaker.release_trial()
+            else:
+                self.breaker.record_success()
+            with self._lock:
+                self.in_flight -= 1
+            self._slots.release()
+
+    def session(self) -> "ProviderSession":
+        """A keep-alive session whose requests go through this transport."""
+        session = ProviderSession(self)
+        with self._lock:
+            self._sessions.append(session)
+        return session
+
+    def stats(self) -> dict:
+        pools = []
+        for session in self._sessions:
+            adapters = {id(adapter): adapter for adapter in session.adapters.values()}
+            for adapter in adapters.values():
+                for key in list(adapter.poolmanager.pools.keys()):
+                    pool = adapter.poolmanager.pools.get(key)
+                    if pool is not None:
+                        pools.append({
+                            "host": f"{key.key_scheme}://{key.key_host}:{key.key_port}",
+                            "idle_connections": sum(1 for conn in list(pool.pool.queue) if conn is not None) if pool.pool else 0,
+                            "connections_opened": pool.num_connections,
+                            "requests": pool.num_requests,
+                        })
+        return {
+            "in_flight": self.in_flight,
+            "max_concurrency": self.max_concurrency,
+            "calls": self.calls,
+            "failures": self.failures,
+            "rejected": self.rejected,
+            "timeout": list(self.timeout),
+            "breaker": self.breaker.snapshot(),
+            "pools": pools,
+        }
+
+
+class ProviderSession(requests.Session):
+    """requests.Session that applies its provider's timeouts, limits and breaker."""
+
+    def __init__(self, transport: ProviderTransport):
+        super().__init__()
+        self.transport = transport
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=transport.max_concurrency, max_retries=0)
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+
+    def send(self, request, **kwargs):
+        transport = self.transport
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = transport.timeout
+        if transport.base_url and transport.origin and request.url.startswith(transport.origin):
+            request.url = transport.base_url + request.url[len(transport.origin):]
+        with transport.guard() as outcome:
+            response = super().send(request, **kwargs)
+            if response.status_code >= 500:
+                # Server errors count against the breaker but are still handed
+                # back to the provider library, which knows how to report them.
+                outcome.fail()
+        return response
+
+
+_transports = {}
+_transports_lock = threading.Lock()
+
+PROVIDER_DEFAULTS = {
+    "anthropic": {"read_timeout": 60.0, "max_concurrency": 32, "acquire_timeout": 5.0},
+    "stripe": {"read_timeout": 10.0, "max_concurrency": 8},
+    "twilio": {"read_timeout": 10.0, "max_concurrency": 8, "origin": "https://api.twilio.com"},
+}
+
+
+def get_transport(name: str) -> ProviderTransport:
+    """Return the process-wide transport for a provider, creating it from the environment."""
+    with _transports_lock:
+        if name not in _transports:
+            _transports[name] = ProviderTransport.from_env(name, **PROVIDER_DEFAULTS.get(name, {}))
+            logging.info(f"Transport for {name}: timeout={_transports[name].timeout}, "
+                         f"max_concurrency={_transports[name].max_concurrency}")
+        return _transports[name]
+
+
+def transport_stats() -> dict:
+    """Pool, concurrency and breaker state for every provider, for monitoring."""
+    with _transports_lock:
+        transports = dict(_transports)
+    return {name: transport.stats() for name, transport in transports.items()}